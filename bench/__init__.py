@@ -0,0 +1,6 @@
+"""Benchmarks
+
+Run from the top of the project, for example:
+python -m bench.diff
+
+"""
@@ -0,0 +1,73 @@
+"""Multi-account sync benchmark
+
+Starts a stand-in server per account and times one sn.py sync of every
+account from a single config file, with --parallel 1 and then with every
+account at once. Each run starts from empty caches.
+
+Example:
+python -m bench.accounts --accounts 4 --notes 500 --latency 0.02
+
+"""
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+from optparse import OptionParser
+
+from bench.server import StandInServer
+from bench.sync import _measure
+
+
+def _write_config(work_dir, servers, jobs):
+    config_file = os.path.join(work_dir, 'config.ini')
+    with open(config_file, 'w') as fh:
+        fh.write('[DEFAULT]\npassword: bench\njobs: {}\n'.format(jobs))
+        for number, server in enumerate(servers):
+            fh.write(
+                '[simplenote:account{0}]\n'
+                'email: bench{0}@example.com\n'
+                'data_dir: {1}\n'
+                'server: {2}\n'.format(
+                    number, os.path.join(work_dir, 'data{}'.format(number)),
+                    server.url))
+    return config_file
+
+
+def run(servers, jobs, parallel):
+    """Returns seconds to sync every account from empty caches."""
+    work_dir = tempfile.mkdtemp()
+    try:
+        config_file = _write_config(work_dir, servers, jobs)
+        seconds, _ = _measure([
+            sys.executable, 'sn.py', '-q', '-c', config_file,
+            '--parallel', str(parallel),
+            '-o', os.path.join(work_dir, 'out', '{account}.json'), 'sync'])
+        return seconds
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-a', '--accounts', type='int', default=4)
+    parser.add_option('-n', '--notes', type='int', default=500)
+    parser.add_option('--latency', type='float', default=0.02)
+    parser.add_option('-j', '--jobs', type='int', default=4)
+    (options, args) = parser.parse_args()
+    servers = [StandInServer(options.notes, latency=options.latency).start()
+               for _ in range(options.accounts)]
+    print('{} accounts of {} notes, {}s latency, {} jobs'.format(
+        options.accounts, options.notes, options.latency, options.jobs))
+    print('{:<10} {:>9}'.format('parallel', 'seconds'))
+    try:
+        for parallel in sorted(set([1, options.accounts])):
+            print('{:<10} {:>9.2f}'.format(
+                parallel, run(servers, options.jobs, parallel)))
+    finally:
+        for server in servers:
+            server.stop()
+
+
+if __name__ == '__main__':
+    main()
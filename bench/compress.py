@@ -0,0 +1,109 @@
+"""Compression benchmark
+
+Cache: for every storage backend and compression setting, the seconds to
+write a synthetic corpus to an empty cache and save it, the seconds to open
+it again and read every note back, and the size on disk.
+
+Network: the client downloads the index and every note from bench.server
+with and without gzip. Bytes are as sent over the network. The time to send
+that many bytes over a --mbit link is shown next to it, loopback being much
+faster than any real connection.
+
+Example:
+python -m bench.compress --notes 5000 --words 200
+
+"""
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
+from optparse import OptionParser
+
+from simplenote import Simplenote, Note
+from bench.corpus import make_notes
+from bench.server import StandInServer
+from simplenote_cli import open_cache
+
+
+def _disk_usage(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, dirs, files in os.walk(path) for name in files)
+
+
+def bench_cache(notes, storage, compression):
+    """Returns (write seconds, read seconds, bytes on disk)."""
+    work_dir = tempfile.mkdtemp()
+    try:
+        start = time.time()
+        cache = open_cache(work_dir, storage, compression)
+        for note in notes:
+            cache.put(note.key, note)
+        cache.compact()
+        write = time.time() - start
+        start = time.time()
+        cache = open_cache(work_dir, storage, compression)
+        for note in cache.notes():
+            # decoded like an export would
+            note.content
+        read = time.time() - start
+        return (write, read, _disk_usage(work_dir))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def bench_network(server, compress, jobs):
+    """Returns (seconds, bytes received)."""
+    sn = Simplenote(
+        'bench@example.com', 'bench', pool_size=jobs, server=server.url,
+        compress=compress)
+    start = time.time()
+    sn.login()
+    keys = [note.key for note in sn.full_index()]
+    pool = ThreadPool(jobs)
+    pool.map(sn.note, keys)
+    pool.close()
+    seconds = time.time() - start
+    sn.pool.close()
+    received = sum(
+        stats['bytes'] for stats in sn.stats.to_dict().itervalues())
+    return (seconds, received)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--notes', type='int', default=5000)
+    parser.add_option('--words', type='int', default=200)
+    parser.add_option('-j', '--jobs', type='int', default=8)
+    parser.add_option(
+        '--mbit', type='float', default=10,
+        help='Link speed used for the transfer time column (default: %default)')
+    (options, args) = parser.parse_args()
+    notes = [Note.from_dict(note) for note in
+             make_notes(options.notes, options.words).itervalues()]
+    print('{} notes of {} words'.format(options.notes, options.words))
+    print('{:<8} {:<6} {:>9} {:>9} {:>12}'.format(
+        'storage', 'codec', 'write s', 'read s', 'bytes'))
+    for storage in ('json', 'sqlite', 'lowmem'):
+        for compression in ('none', 'zlib', 'fast'):
+            write, read, size = bench_cache(notes, storage, compression)
+            print('{:<8} {:<6} {:>9.2f} {:>9.2f} {:>12}'.format(
+                storage, compression, write, read, size))
+    server = StandInServer(options.notes, options.words).start()
+    print()
+    print('{:<8} {:>9} {:>12} {:>14}'.format(
+        'gzip', 'seconds', 'bytes', 'at {:g} Mbit s'.format(options.mbit)))
+    try:
+        for compress in (False, True):
+            seconds, received = bench_network(server, compress, options.jobs)
+            print('{:<8} {:>9.2f} {:>12} {:>14.2f}'.format(
+                'on' if compress else 'off', seconds, received,
+                received * 8 / (options.mbit * 1e6)))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Synthetic note corpus used by the benchmarks."""
+import bisect
+import random
+import time
+
+
+_TAGS = ['work', 'home', 'todo', 'ideas', 'recipes', 'travel']
+
+
+def _make_vocabulary(size=5000, seed=0):
+    """Made up words, most common first."""
+    rand = random.Random(seed)
+    syllables = ['ka', 'lo', 'mi', 'ne', 'ru', 'ta', 'vo', 'zi', 'pe', 'so']
+    words = set()
+    while len(words) < size:
+        words.add(''.join(
+            rand.choice(syllables) for _ in range(rand.randint(1, 4))))
+    return sorted(words, key=len)
+
+
+_WORDS = _make_vocabulary()
+# word frequencies follow Zipf's law like they do in real text
+_CUMULATIVE = []
+for _rank in range(len(_WORDS)):
+    _CUMULATIVE.append((_CUMULATIVE[-1] if _CUMULATIVE else 0) + 1.0 / (_rank + 1))
+
+
+def _words(count, rand):
+    total = _CUMULATIVE[-1]
+    return ' '.join(
+        _WORDS[bisect.bisect(_CUMULATIVE, rand.random() * total)]
+        for _ in range(count))
+
+
+def make_key(number):
+    """Key for note number, stable between runs."""
+    return 'agtzaW1wbGUtbm90ZXINCxIETm90ZRi{:08d}'.format(number)
+
+
+def make_note(number, words=60, rand=random):
+    """Full note dictionary like the one returned by the api."""
+    now = time.time()
+    return {
+        'key': make_key(number),
+        'deleted': 0,
+        'syncnum': rand.randint(1, 50),
+        'version': rand.randint(1, 50),
+        'minversion': 10,
+        'modifydate': '{:.6f}'.format(now - rand.randint(0, 10 ** 7)),
+        'createdate': '{:.6f}'.format(now - 10 ** 7),
+        'systemtags': rand.sample(['pinned', 'markdown'], rand.randint(0, 1)),
+        'tags': rand.sample(_TAGS, rand.randint(0, 3)),
+        'content': _words(6, rand) + '\n' + _words(words, rand),
+    }
+
+
+def make_notes(count, words=60, seed=1):
+    """Dictionary of count notes keyed by note key."""
+    rand = random.Random(seed)
+    notes = {}
+    for number in range(count):
+        note = make_note(number, words, rand)
+        notes[note['key']] = note
+    return notes
+
+
+def index_entry(note):
+    """Index entry for a note, which is the note without its content."""
+    entry = dict(note)
+    del entry['content']
+    return entry
@@ -0,0 +1,72 @@
+"""Delta sync benchmark
+
+Fills a cache from bench.server with a full sync, then changes --modify
+notes on the server before each of --runs syncs, once asking only for the
+notes modified since the last sync and once walking the whole index with
+--full. Reports api calls and time per run. Finally --remove notes are
+deleted on the server and a full sync removes them from the cache.
+
+Example:
+python -m bench.delta --notes 10000 --latency 0.01 --modify 5
+
+"""
+from __future__ import print_function
+import json
+import os
+import shutil
+import sys
+import tempfile
+from optparse import OptionParser
+
+from bench.server import StandInServer
+from bench.sync import _measure, _write_config
+
+
+def _report(name, seconds, server):
+    print('{:<10} {:>9.2f} {:>7} {:>7}'.format(
+        name, seconds, server.counts['index'], server.counts['data']))
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--notes', type='int', default=10000)
+    parser.add_option('--latency', type='float', default=0.01)
+    parser.add_option('-j', '--jobs', type='int', default=4)
+    parser.add_option('--storage', default='journal')
+    parser.add_option('--modify', type='int', default=5)
+    parser.add_option('--remove', type='int', default=5)
+    parser.add_option('--runs', type='int', default=3)
+    (options, args) = parser.parse_args()
+    server = StandInServer(options.notes, latency=options.latency).start()
+    work_dir = tempfile.mkdtemp()
+    env = dict(os.environ, LOGLEVEL='ERROR')
+    output = os.path.join(work_dir, 'out.json')
+    command = [
+        sys.executable, 'sn.py', '-q', '-c',
+        _write_config(work_dir, server.url, options.jobs, options.storage),
+        '-o', output]
+    print('{} notes, {}s latency, {} modified per run'.format(
+        options.notes, options.latency, options.modify))
+    print('{:<10} {:>9} {:>7} {:>7}'.format('run', 'seconds', 'index', 'notes'))
+    try:
+        server.reset_counts()
+        _report('first', _measure(command, env)[0], server)
+        for _ in range(options.runs):
+            for name, extra in (('delta', []), ('full', ['--full'])):
+                server.modify(options.modify)
+                server.reset_counts()
+                _report(name, _measure(command + extra, env)[0], server)
+        server.remove(options.remove)
+        server.reset_counts()
+        _report('removed', _measure(command + ['--full'], env)[0], server)
+        with open(output) as fh:
+            exported = len(json.load(fh))
+        print('{} notes exported, {} on the server'.format(
+            exported, len(server.keys)))
+    finally:
+        server.stop()
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Micro-benchmark for SimpleNoteCache.diff
+
+Times the comparison of a cache with an index where about 1% of notes were
+added, modified and deleted, for increasing note counts. Time per note
+should stay flat as the count grows.
+
+"""
+from __future__ import print_function
+import shutil
+import tempfile
+import timeit
+
+from simplenote import Note, NoteMeta
+from simplenote_cli import SimpleNoteCache
+from bench.corpus import make_notes, make_key, index_entry
+
+
+def build(count):
+    """Returns (cache, index) with roughly 1% of each kind of change."""
+    step = 100
+    notes = make_notes(count)
+    keys = sorted(notes)
+    removed = set(keys[1::step])
+    index = [
+        NoteMeta.from_dict(index_entry(notes[key]))
+        for key in keys if key not in removed]
+    for entry in index[::step]:
+        entry.syncnum += 1
+    for number in range(count, count + count // step):
+        index.append(NoteMeta(key=make_key(number), syncnum=1, deleted=0))
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache = SimpleNoteCache(cache_dir)
+    finally:
+        shutil.rmtree(cache_dir)
+    cache.cache = dict((key, Note.from_dict(note)) for key, note in notes.items())
+    return (cache, index)
+
+
+def main():
+    print('{:>8} {:>10} {:>12}'.format('notes', 'seconds', 'usec/note'))
+    for count in (1000, 10000, 100000):
+        cache, index = build(count)
+        runs = 5
+        seconds = min(timeit.repeat(
+            lambda: cache.diff(index), number=1, repeat=runs))
+        print('{:>8} {:>10.4f} {:>12.2f}'.format(
+            count, seconds, seconds / count * 10 ** 6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Export benchmark
+
+Times exporting a synthetic corpus from cached Note objects: each format
+sn.py supports on its own, every format with a separate pass per format,
+and every format in a single pass, with and without worker processes.
+Reports notes per second and the size of the output.
+
+Then the per note text export is updated after --changed notes change:
+rewriting every file, a pass over every note that skips notes whose
+content hash is in the manifest, and exporting only the changed notes.
+
+Example:
+python -m bench.export --notes 20000 --processes 4
+
+"""
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import time
+from multiprocessing import cpu_count
+from optparse import OptionParser
+
+from simplenote import Note
+from bench.corpus import make_notes
+from simplenote_cli import EXPORT_FORMATS, NoteFileWriter, export
+
+
+def _disk_usage(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, dirs, files in os.walk(path) for name in files)
+
+
+def run(notes, work_dir, passes, processes=1):
+    """Export notes in passes, a list of format lists.
+
+    @return (seconds, bytes written)
+    """
+    start = time.time()
+    for formats in passes:
+        outputs = [(name, os.path.join(work_dir, name)) for name in formats]
+        export(notes, outputs, processes)
+    seconds = time.time() - start
+    size = sum(_disk_usage(os.path.join(work_dir, name))
+               for formats in passes for name in formats)
+    for name in os.listdir(work_dir):
+        path = os.path.join(work_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    return (seconds, size)
+
+
+def _change(notes, count):
+    """Replace the first count notes with edited copies, returns the copies."""
+    changed = []
+    for number, note in enumerate(notes[:count]):
+        data = note.to_dict()
+        data['content'] += u' edited'
+        data['syncnum'] += 1
+        notes[number] = Note.from_dict(data)
+        changed.append(notes[number])
+    return changed
+
+
+def run_updates(notes, work_dir, count):
+    """Update a text export after count notes change, each way in turn.
+
+    Yields (name, seconds, files written)
+    """
+    directory = os.path.join(work_dir, 'text')
+    outputs = [('text', directory)]
+    export(notes, outputs)
+    updates = [
+        ('rewrite every file', True, False),
+        ('every note, manifest', False, False),
+        ('changed notes only', False, True),
+    ]
+    for name, rewrite, only_changed in updates:
+        changed = _change(notes, count)
+        if rewrite:
+            shutil.rmtree(directory)
+        NoteFileWriter.begin(directory)
+        start = time.time()
+        if only_changed:
+            export(changed, outputs, removed=[])
+        else:
+            export(notes, outputs)
+        seconds = time.time() - start
+        written = sum(
+            1 for filename in os.listdir(directory)
+            if not filename.startswith('.') and
+            os.path.getmtime(os.path.join(directory, filename)) >= start)
+        yield (name, seconds, written)
+    shutil.rmtree(directory)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--notes', type='int', default=20000)
+    parser.add_option('--words', type='int', default=60)
+    parser.add_option(
+        '-p', '--processes', type='int', default=cpu_count(),
+        help='Worker processes for the parallel run (default: %default)')
+    parser.add_option(
+        '-f', '--formats', default=','.join(sorted(EXPORT_FORMATS)),
+        help='Comma separated formats to export (default: %default)')
+    parser.add_option(
+        '--changed', type='int', default=100,
+        help='Notes changed before updating the text export (default: %default)')
+    (options, args) = parser.parse_args()
+    notes = [Note.from_dict(note) for note in
+             make_notes(options.notes, options.words).itervalues()]
+    names = options.formats.split(',')
+    runs = [(name, [[name]], 1) for name in names]
+    runs += [
+        ('pass per format', [[name] for name in names], 1),
+        ('single pass', [names], 1),
+        ('single pass, {} processes'.format(options.processes), [names],
+         options.processes),
+    ]
+    work_dir = tempfile.mkdtemp()
+    print('{:<28} {:>9} {:>10} {:>12}'.format(
+        'export', 'seconds', 'notes/sec', 'bytes'))
+    try:
+        for name, passes, processes in runs:
+            seconds, size = run(notes, work_dir, passes, processes)
+            print('{:<28} {:>9.2f} {:>10.0f} {:>12}'.format(
+                name, seconds, len(notes) / seconds, size))
+        print()
+        print('{:<28} {:>9} {:>10}'.format(
+            'text update', 'seconds', 'written'))
+        for name, seconds, written in run_updates(
+                notes, work_dir, options.changed):
+            print('{:<28} {:>9.2f} {:>10}'.format(name, seconds, written))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
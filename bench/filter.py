@@ -0,0 +1,77 @@
+"""Filtered export benchmark
+
+For every storage backend, fills a cache with a synthetic corpus and times
+exporting a narrow selection of it: notes with --tag modified in the last
+--days of the corpus. Once by reading every note and filtering afterwards,
+the way a downstream job sifting a full export would, and once with the
+filter handed to the cache. Also the same selection with only the key and
+tags fields.
+
+Example:
+python -m bench.filter --notes 20000 --days 2
+
+"""
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import time
+from optparse import OptionParser
+
+from simplenote import Note
+from bench.corpus import make_notes
+from simplenote_cli import NoteFilter, open_cache, export
+
+
+def timed_export(notes, work_dir, fields=None):
+    """Returns (seconds, notes exported)."""
+    start = time.time()
+    count = export(
+        notes, [('json', os.path.join(work_dir, 'out.json'))], fields=fields)
+    return (time.time() - start, count)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--notes', type='int', default=20000)
+    parser.add_option('--words', type='int', default=200)
+    parser.add_option('--tag', default='recipes')
+    parser.add_option(
+        '--days', type='float', default=2,
+        help='Days of the corpus\'s ~115 to select (default: %default)')
+    (options, args) = parser.parse_args()
+    notes = [Note.from_dict(note) for note in
+             make_notes(options.notes, options.words).itervalues()]
+    newest = max(float(note.modifydate) for note in notes)
+    where = NoteFilter(
+        [options.tag], [], newest - options.days * 24 * 60 * 60, None)
+    print('{} notes of {} words, tag {} in the last {} days'.format(
+        options.notes, options.words, options.tag, options.days))
+    print('{:<8} {:<22} {:>9} {:>7}'.format(
+        'storage', 'export', 'seconds', 'notes'))
+    for storage in ('json', 'sqlite', 'lowmem'):
+        work_dir = tempfile.mkdtemp()
+        try:
+            cache = open_cache(work_dir, storage)
+            for note in notes:
+                cache.put(note.key, note)
+            cache.compact()
+            cache = open_cache(work_dir, storage)
+            runs = [
+                ('every note', cache.notes(), None),
+                ('filter after reading',
+                 (note for note in cache.notes() if where.match(note)), None),
+                ('filter in the cache', cache.notes(where=where), None),
+                ('... key and tags only', cache.notes(where=where),
+                 ['key', 'tags']),
+            ]
+            for name, selected, fields in runs:
+                seconds, count = timed_export(selected, work_dir, fields)
+                print('{:<8} {:<22} {:>9.3f} {:>7}'.format(
+                    storage, name, seconds, count))
+        finally:
+            shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
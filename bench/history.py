@@ -0,0 +1,105 @@
+"""Note history benchmark
+
+Stores --versions versions of each of --notes synthetic notes in a
+util.history store, each version editing a few words of the one before,
+and reports the size of the store next to the size of every version kept
+whole, raw and zlib compressed. Then times getting one note back at its
+latest and oldest version, a snapshot of the whole corpus half way through
+and pruning the older half, then pruning again as every sync does.
+
+Example:
+python -m bench.history --notes 1000 --versions 20
+
+"""
+from __future__ import print_function
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import zlib
+from optparse import OptionParser
+
+from simplenote import Note
+from bench.corpus import make_notes, _words
+from util.history import HistoryStore
+
+
+def edit(note, rand, when):
+    """Next version of note, a few words added or replaced."""
+    data = dict(note)
+    words = data['content'].split(' ')
+    start = rand.randint(0, len(words))
+    end = start + rand.choice([0, rand.randint(1, 5)])
+    words[start:end] = [_words(rand.randint(1, 8), rand)]
+    data['content'] = ' '.join(words)
+    data['syncnum'] += 1
+    data['modifydate'] = '{:.6f}'.format(when)
+    return data
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return (time.time() - start, result)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--notes', type='int', default=1000)
+    parser.add_option('--words', type='int', default=200)
+    parser.add_option('--versions', type='int', default=20)
+    parser.add_option('--keyframe', type='int', default=16)
+    (options, args) = parser.parse_args()
+    rand = random.Random(2)
+    notes = make_notes(options.notes, options.words)
+    work_dir = tempfile.mkdtemp()
+    filename = os.path.join(work_dir, 'history.sqlite')
+    history = HistoryStore(filename, options.keyframe)
+    raw = packed = 0
+    start = time.time()
+    for version in range(options.versions):
+        when = 1e9 + version * 86400
+        for key in sorted(notes):
+            if version:
+                notes[key] = edit(notes[key], rand, when)
+            else:
+                notes[key]['modifydate'] = '{:.6f}'.format(when)
+            data = json.dumps(notes[key])
+            raw += len(data)
+            packed += len(zlib.compress(data))
+            history.add(Note.from_dict(notes[key]))
+        history.db.commit()
+    seconds = time.time() - start
+    size = os.path.getsize(filename)
+    print('{} notes of {} words, {} versions each'.format(
+        options.notes, options.words, options.versions))
+    print('{:<24} {:>12}'.format('every version, raw', raw))
+    print('{:<24} {:>12}'.format('every version, zlib', packed))
+    print('{:<24} {:>12}'.format('history store', size))
+    print('{:<24} {:>12.2f}'.format('store seconds', seconds))
+    key = sorted(notes)[0]
+    middle = 1e9 + options.versions // 2 * 86400
+    runs = [
+        ('one note, latest ms', 1000, history.get, key),
+        ('one note, oldest ms', 1000, history.get, key, 1e9),
+        ('snapshot seconds', 1, lambda at: sum(1 for _ in history.snapshot(at)),
+         middle),
+        ('prune seconds', 1, history.prune, middle),
+        ('prune again seconds', 1, history.prune, middle),
+    ]
+    try:
+        for name, scale, func in ((run[0], run[1], run[2:]) for run in runs):
+            seconds, result = timed(*func)
+            print('{:<24} {:>12.2f}'.format(name, seconds * scale))
+        history.db.execute('VACUUM')
+        print('{:<24} {:>12}'.format(
+            'history store, pruned', os.path.getsize(filename)))
+    finally:
+        history.close()
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Per note memory use of plain dictionaries compared with Note objects
+
+Builds a synthetic corpus, decodes it from JSON the way the api responses
+and cache are read, and measures the deep size of each representation. The
+size of objects shared between notes, like interned tags, is counted once.
+
+"""
+from __future__ import print_function
+import json
+import sys
+
+from simplenote import Note, NoteMeta
+from bench.corpus import make_notes, index_entry
+
+
+def deep_size(obj, seen):
+    """Size of obj and everything it refers to that isn't in seen."""
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += deep_size(key, seen) + deep_size(value, seen)
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            size += deep_size(item, seen)
+    elif isinstance(obj, NoteMeta):
+        names = NoteMeta.__slots__
+        if isinstance(obj, Note):
+            names += Note.__slots__
+        for name in names:
+            size += deep_size(getattr(obj, name), seen)
+    return size
+
+
+def measure(label, objects, count):
+    total = deep_size(objects, set())
+    print('{:<12} {:>8.1f} MB {:>8.0f} bytes/note'.format(
+        label, total / 2.0 ** 20, total / float(count)))
+    return total
+
+
+def main(count=100000):
+    raw = json.dumps(make_notes(count).values())
+    print('{} notes, {:.1f} MB of JSON'.format(count, len(raw) / 2.0 ** 20))
+    dicts = json.loads(raw)
+    before = measure('dict note', dicts, count)
+    notes = [Note.from_dict(note) for note in dicts]
+    after = measure('Note', notes, count)
+    print('saving {:.0%}'.format(1 - after / float(before)))
+    del dicts, notes
+    entries = [index_entry(note) for note in json.loads(raw)]
+    before = measure('dict index', entries, count)
+    after = measure('NoteMeta', [NoteMeta.from_dict(e) for e in entries], count)
+    print('saving {:.0%}'.format(1 - after / float(before)))
+
+
+if __name__ == '__main__':
+    main()
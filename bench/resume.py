@@ -0,0 +1,86 @@
+"""Interrupted sync benchmark
+
+Syncs an empty cache from bench.server once without stopping, then again
+from scratch but killed part way through (--kill of the way through the
+first run's time) and run again to finish. Reports the requests each run
+sent to the server, an interrupted sync that resumes should add up to about
+the same as one that never stopped instead of starting over.
+
+Example:
+python -m bench.resume --notes 2000 --latency 0.01 --jobs 4
+
+"""
+from __future__ import print_function
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+from bench.server import StandInServer
+from bench.sync import _write_config, _ROOT
+
+
+def _report(name, seconds, server):
+    print('{:<12} {:>9.2f} {:>7} {:>7}'.format(
+        name, seconds, server.counts['index'], server.counts['data']))
+
+
+def run(server, command, env, kill=None):
+    """Run command, killed after kill seconds if given.
+
+    @return seconds it ran for
+    """
+    server.reset_counts()
+    start = time.time()
+    child = subprocess.Popen(command, cwd=_ROOT, env=env)
+    if kill is not None:
+        time.sleep(kill)
+        if child.poll() is None:
+            child.send_signal(signal.SIGKILL)
+    child.wait()
+    return time.time() - start
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--notes', type='int', default=2000)
+    parser.add_option('--latency', type='float', default=0.01)
+    parser.add_option('-j', '--jobs', type='int', default=4)
+    parser.add_option('--storage', default='journal')
+    parser.add_option(
+        '--kill', type='float', default=0.5,
+        help='Share of the full run to kill the sync after (default: %default)')
+    (options, args) = parser.parse_args()
+    server = StandInServer(options.notes, latency=options.latency).start()
+    env = dict(os.environ, LOGLEVEL='ERROR')
+    print('{} notes, {}s latency, {} jobs, {} storage'.format(
+        options.notes, options.latency, options.jobs, options.storage))
+    print('{:<12} {:>9} {:>7} {:>7}'.format('run', 'seconds', 'index', 'notes'))
+    try:
+        for name in ('clean', 'interrupted'):
+            work_dir = tempfile.mkdtemp()
+            try:
+                config_file = _write_config(
+                    work_dir, server.url, options.jobs, options.storage)
+                command = [
+                    sys.executable, 'sn.py', '-q', '-c', config_file,
+                    '-o', os.path.join(work_dir, 'out.json')]
+                if name == 'clean':
+                    full = run(server, command, env)
+                    _report(name, full, server)
+                    continue
+                _report('killed', run(
+                    server, command, env, full * options.kill), server)
+                _report('resumed', run(server, command, env), server)
+            finally:
+                shutil.rmtree(work_dir)
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Search index benchmark
+
+Builds a search index for a synthetic corpus and times some typical
+queries against it: a rare word, common words, a phrase and a tag.
+Queries are timed fetching the top 20 results, like sn.py search.
+
+Example:
+python -m bench.search --notes 100000
+
+"""
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import time
+from optparse import OptionParser
+
+from simplenote import Note
+from bench.corpus import make_notes, _WORDS
+from util.search import SearchIndex
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--notes', type='int', default=100000)
+    (options, args) = parser.parse_args()
+    work_dir = tempfile.mkdtemp()
+    try:
+        notes = [Note.from_dict(note)
+                 for note in make_notes(options.notes).itervalues()]
+        search = SearchIndex(os.path.join(work_dir, 'search.sqlite'))
+        start = time.time()
+        search.rebuild(notes)
+        print('{} notes indexed in {:.1f} seconds, {:.1f} MB'.format(
+            len(notes), time.time() - start,
+            os.path.getsize(search.filename) / 2.0 ** 20))
+        queries = [
+            _WORDS[-1],
+            '{} {}'.format(_WORDS[2000], _WORDS[3000]),
+            '{} {}'.format(_WORDS[0], _WORDS[1]),
+            '"{} {}"'.format(_WORDS[0], _WORDS[1]),
+            'tag:recipes {}'.format(_WORDS[500]),
+        ]
+        print('{:<30} {:>8} {:>8}'.format('query', 'matches', 'ms'))
+        for query in queries:
+            start = time.time()
+            search.search(query)
+            seconds = time.time() - start
+            matches = len(search.search(query, limit=options.notes))
+            print('{:<30} {:>8} {:>8.1f}'.format(query, matches, seconds * 1000))
+        search.close()
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""Local stand-in for the Simplenote api
+
+Serves a synthetic corpus over the same endpoints the client uses:
+/api/login, /api2/index (with length and mark paging, and since) and
+/api2/data/<key>.
+Every request can be delayed and a share of them answered with errors, to
+see how the client copes with a slow or unreliable server. Responses are
+gzip compressed for clients that ask for it, unless gzip is turned off.
+
+Run on its own with:
+python -m bench.server --notes 5000 --latency 0.02
+
+"""
+from __future__ import print_function
+import BaseHTTPServer
+import SocketServer
+import json
+import random
+import socket
+import sys
+import threading
+import time
+import urlparse
+import zlib
+from collections import defaultdict
+from optparse import OptionParser
+
+from bench.corpus import make_notes, index_entry
+
+
+TOKEN = 'stand-in-token'
+
+
+class _HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        # clients that are killed, like in bench.resume, reset connections
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(
+                self, request, client_address)
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # python 2's table of reasons stops at 417
+    responses = dict(
+        BaseHTTPServer.BaseHTTPRequestHandler.responses,
+        **{429: ('Too Many Requests', '')})
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type='application/json'):
+        headers = 'Content-Type: {}\r\n'.format(content_type)
+        if (body and self.server.stand_in.gzip and
+                'gzip' in self.headers.getheader('Accept-Encoding', '')):
+            gzip = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            body = gzip.compress(body) + gzip.flush()
+            headers += 'Content-Encoding: gzip\r\n'
+        # one write per response, separate small writes stall on delayed acks
+        self.wfile.write(
+            'HTTP/1.1 {} {}\r\n{}Content-Length: {}\r\n\r\n{}'.format(
+                status, self.responses[status][0], headers, len(body), body))
+
+    def _fail(self, endpoint):
+        """Sleep for the latency then maybe send an injected error."""
+        stand_in = self.server.stand_in
+        stand_in.count(endpoint)
+        time.sleep(stand_in.latency)
+        roll = random.random()
+        if roll < stand_in.error_rate:
+            stand_in.count('error')
+            self._send(503, '')
+            return True
+        if roll < stand_in.error_rate + stand_in.throttle_rate:
+            stand_in.count('throttled')
+            self._send(429, '')
+            return True
+        return False
+
+    def do_POST(self):  # noqa: N802
+        self.rfile.read(int(self.headers.getheader('Content-Length', 0)))
+        if self._fail('login'):
+            return
+        if self.path != '/api/login':
+            return self._send(404, '')
+        self._send(200, TOKEN, 'text/plain')
+
+    def do_GET(self):  # noqa: N802
+        url = urlparse.urlsplit(self.path)
+        query = dict(urlparse.parse_qsl(url.query))
+        if url.path == '/api2/index':
+            endpoint = 'index'
+        elif url.path.startswith('/api2/data/'):
+            endpoint = 'data'
+        else:
+            return self._send(404, '')
+        if self._fail(endpoint):
+            return
+        if query.get('auth') != TOKEN:
+            return self._send(401, '')
+        if endpoint == 'index':
+            self._index(query)
+        else:
+            self._note(url.path[len('/api2/data/'):])
+
+    def _index(self, query):
+        stand_in = self.server.stand_in
+        length = min(int(query.get('length', 100)), 100)
+        start = int(query.get('mark', 0))
+        keys = stand_in.keys
+        if 'since' in query:
+            since = float(query['since'])
+            keys = [key for key in keys
+                    if float(stand_in.notes[key]['modifydate']) > since]
+        index = {
+            'count': len(keys[start:start + length]),
+            'data': [index_entry(stand_in.notes[key])
+                     for key in keys[start:start + length]],
+        }
+        if start + length < len(keys):
+            index['mark'] = str(start + length)
+        self._send(200, json.dumps(index))
+
+    def _note(self, key):
+        note = self.server.stand_in.notes.get(key)
+        if note is None:
+            return self._send(404, '')
+        self._send(200, json.dumps(note))
+
+
+class StandInServer(object):
+    """Simplenote api stand-in running on a background thread.
+
+    notes: Number of notes in the synthetic corpus
+    words: Words of content per note
+    latency: Seconds to wait before answering each request
+    error_rate: Share of requests answered with 503
+    throttle_rate: Share of requests answered with 429
+    gzip: Compress responses for clients that accept gzip
+
+    """
+    def __init__(self, notes=1000, words=60, latency=0, error_rate=0,
+                 throttle_rate=0, port=0, gzip=True):
+        self.notes = make_notes(notes, words)
+        self.keys = sorted(self.notes)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.gzip = gzip
+        self.counts = defaultdict(int)
+        self._lock = threading.Lock()
+        self._httpd = _HTTPServer(('127.0.0.1', port), _Handler)
+        self._httpd.stand_in = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self._httpd.server_port)
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts = defaultdict(int)
+
+    def modify(self, count):
+        """Bump the syncnum of count notes so the next sync fetches them."""
+        for key in random.sample(self.keys, count):
+            self.notes[key]['syncnum'] += 1
+            self.notes[key]['modifydate'] = '{:.6f}'.format(time.time())
+
+    def remove(self, count):
+        """Delete count notes for good, not just move them to the trash."""
+        for key in random.sample(self.keys, count):
+            del self.notes[key]
+            self.keys.remove(key)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-p', '--port', type='int', default=8080)
+    parser.add_option('-n', '--notes', type='int', default=1000)
+    parser.add_option('--latency', type='float', default=0)
+    parser.add_option('--error-rate', type='float', default=0)
+    parser.add_option('--throttle-rate', type='float', default=0)
+    parser.add_option('--no-gzip', dest='gzip', default=True,
+                      action='store_false')
+    (options, args) = parser.parse_args()
+    server = StandInServer(
+        options.notes, latency=options.latency, error_rate=options.error_rate,
+        throttle_rate=options.throttle_rate, port=options.port,
+        gzip=options.gzip).start()
+    print('serving {} notes on {}'.format(options.notes, server.url))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
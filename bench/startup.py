@@ -0,0 +1,76 @@
+"""Startup time benchmark
+
+Times each sn.py command from process start to exit against a small synced
+cache, where startup rather than the work itself is most of the run. Every
+command is run --runs times and the fastest run is reported, along with a
+bare interpreter and importing simplenote_cli for comparison.
+
+Example:
+python -m bench.startup --notes 200 --runs 10
+
+"""
+from __future__ import print_function
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+from bench.server import StandInServer
+from bench.sync import _write_config, _ROOT
+
+
+def best_time(args, runs, env):
+    best = None
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(runs):
+            start = time.time()
+            subprocess.check_call(args, cwd=_ROOT, env=env, stdout=devnull)
+            seconds = time.time() - start
+            if best is None or seconds < best:
+                best = seconds
+    return best
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--notes', type='int', default=200)
+    parser.add_option('-r', '--runs', type='int', default=10)
+    (options, args) = parser.parse_args()
+    server = StandInServer(options.notes).start()
+    work_dir = tempfile.mkdtemp()
+    env = dict(os.environ, LOGLEVEL='ERROR')
+    # time it as installed, with modules loaded from compiled .pyc files
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    try:
+        config_file = _write_config(work_dir, server.url, 4, 'json')
+        sn = [sys.executable, 'sn.py', '-q', '-c', config_file,
+              '-o', os.path.join(work_dir, 'out.json')]
+        # fill the cache and build the search index
+        subprocess.check_call(sn + ['sync'], cwd=_ROOT, env=env)
+        subprocess.check_call(
+            sn + ['search', 'mi'], cwd=_ROOT, env=env,
+            stdout=open(os.devnull, 'w'))
+        runs = [
+            ('python', [sys.executable, '-c', 'pass']),
+            ('import', [sys.executable, '-c', 'import simplenote_cli']),
+            ('--version', [sys.executable, 'sn.py', '--version']),
+            ('stats', sn + ['stats']),
+            ('search', sn + ['search', 'mi']),
+            ('export', sn + ['export']),
+            ('sync', sn + ['sync']),
+        ]
+        print('{} notes, best of {} runs'.format(options.notes, options.runs))
+        print('{:<12} {:>8}'.format('command', 'ms'))
+        for name, command in runs:
+            seconds = best_time(command, options.runs, env)
+            print('{:<12} {:>8.1f}'.format(name, seconds * 1000))
+    finally:
+        server.stop()
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""End to end sync benchmark against the local stand-in server
+
+Runs the Simplenote client and sn.py against bench.server and reports wall
+time, api calls, notes downloaded per second and peak memory for each run.
+Every run is a separate process so peak memory isn't shared between them.
+Peak memory is ru_maxrss, which is KB on Linux and bytes on Mac OS X.
+
+Runs:
+client: Simplenote.full_index then every note with --jobs threads
+sn cold: sn.py with an empty cache, downloading every note
+sn warm: sn.py again after --modify notes changed on the server
+
+Example:
+python -m bench.sync --notes 5000 --latency 0.02 --jobs 1,8
+
+"""
+from __future__ import print_function
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
+from optparse import OptionParser
+
+from bench.server import StandInServer
+
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_client(url, jobs):
+    """Download the index and every note with the client alone."""
+    from simplenote import Simplenote
+    sn = Simplenote('bench@example.com', 'bench', pool_size=jobs, server=url)
+    sn.login()
+    keys = [note.key for note in sn.full_index()]
+    pool = ThreadPool(jobs)
+    pool.map(sn.note, keys)
+    pool.close()
+
+
+def _measure(args, env=None):
+    """Run args in a child process, returns (seconds, peak rss)."""
+    start = time.time()
+    child = subprocess.Popen(args, cwd=_ROOT, env=env)
+    (_, status, usage) = os.wait4(child.pid, 0)
+    seconds = time.time() - start
+    if status != 0:
+        raise RuntimeError('{} exited with {}'.format(args, status))
+    return (seconds, usage.ru_maxrss)
+
+
+def _write_config(work_dir, url, jobs, storage):
+    config_file = os.path.join(work_dir, 'config.ini')
+    with open(config_file, 'w') as fh:
+        fh.write(
+            '[simplenote]\n'
+            'email: bench@example.com\n'
+            'password: bench\n'
+            'data_dir: {}\n'
+            'server: {}\n'
+            'jobs: {}\n'
+            'storage: {}\n'.format(
+                os.path.join(work_dir, 'data'), url, jobs, storage))
+    return config_file
+
+
+def _report(name, jobs, seconds, server, fetched, peak):
+    print('{:<8} {:>4} {:>9.2f} {:>9} {:>10.1f} {:>12}'.format(
+        name, jobs, seconds, server.counts['index'] + server.counts['data'],
+        fetched / seconds, peak))
+
+
+def run(server, jobs, storage, modify):
+    work_dir = tempfile.mkdtemp()
+    try:
+        server.reset_counts()
+        seconds, peak = _measure([
+            sys.executable, '-m', 'bench.sync', '--client', server.url,
+            '--jobs', str(jobs)])
+        _report('client', jobs, seconds, server, len(server.keys), peak)
+        config_file = _write_config(work_dir, server.url, jobs, storage)
+        command = [
+            sys.executable, 'sn.py', '-q', '-c', config_file,
+            '-o', os.path.join(work_dir, 'out.json')]
+        env = dict(os.environ, LOGLEVEL='ERROR')
+        server.reset_counts()
+        seconds, peak = _measure(command, env)
+        _report('sn cold', jobs, seconds, server, server.counts['data'], peak)
+        server.modify(modify)
+        server.reset_counts()
+        seconds, peak = _measure(command, env)
+        _report('sn warm', jobs, seconds, server, server.counts['data'], peak)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--notes', type='int', default=1000)
+    parser.add_option('--words', type='int', default=60)
+    parser.add_option('--latency', type='float', default=0.01)
+    parser.add_option('--error-rate', type='float', default=0)
+    parser.add_option('--throttle-rate', type='float', default=0)
+    parser.add_option(
+        '-j', '--jobs', default='1,8',
+        help='Comma separated worker counts to try (default: %default)')
+    parser.add_option('--storage', default='json')
+    parser.add_option(
+        '--modify', type='int', default=10,
+        help='Notes changed between the cold and warm runs')
+    parser.add_option('--client', metavar='URL', help='internal, see run_client')
+    (options, args) = parser.parse_args()
+    if options.client:
+        return run_client(options.client, int(options.jobs))
+    server = StandInServer(
+        options.notes, options.words, options.latency, options.error_rate,
+        options.throttle_rate).start()
+    print('{} notes, {}s latency, {:.0%} errors, {:.0%} throttled'.format(
+        options.notes, options.latency, options.error_rate,
+        options.throttle_rate))
+    print('{:<8} {:>4} {:>9} {:>9} {:>10} {:>12}'.format(
+        'run', 'jobs', 'seconds', 'api calls', 'notes/sec', 'peak rss'))
+    try:
+        for jobs in options.jobs.split(','):
+            run(server, int(jobs), options.storage, options.modify)
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
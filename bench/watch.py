@@ -0,0 +1,105 @@
+"""Watch mode benchmark
+
+Syncs --rounds times against bench.server with --modify notes changed on
+the server before each sync: first the cron way, a new sn.py sync process
+each time, then one sn.py watch process syncing every --interval seconds.
+Reports the mean seconds per sync, from process start to exit for cron and
+as logged by watch for watch mode, and the requests per sync.
+
+Example:
+python -m bench.watch --notes 20000 --rounds 5
+
+"""
+from __future__ import print_function
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+from optparse import OptionParser
+
+from bench.server import StandInServer
+from bench.sync import _measure, _write_config, _ROOT
+
+
+_SYNCED = re.compile(r'synced .* in ([\d.]+) seconds')
+
+
+def _report(name, seconds, rounds, server):
+    print('{:<8} {:>9.3f} {:>7.1f} {:>7.1f} {:>7.1f}'.format(
+        name, seconds / rounds, server.counts['login'] / float(rounds),
+        server.counts['index'] / float(rounds),
+        server.counts['data'] / float(rounds)))
+
+
+def run_cron(server, command, env, rounds, modify):
+    server.reset_counts()
+    seconds = 0
+    for _ in range(rounds):
+        server.modify(modify)
+        seconds += _measure(command + ['sync'], env)[0]
+    _report('cron', seconds, rounds, server)
+
+
+def run_watch(server, command, env, rounds, modify, interval):
+    server.modify(modify)
+    server.reset_counts()
+    child = subprocess.Popen(
+        command + ['watch', '--interval', str(interval)], cwd=_ROOT,
+        env=dict(env, LOGLEVEL='INFO'), stderr=subprocess.PIPE)
+    seconds = 0
+    done = 0
+    try:
+        for line in iter(child.stderr.readline, ''):
+            match = _SYNCED.search(line)
+            if match is None:
+                continue
+            seconds += float(match.group(1))
+            done += 1
+            if done == rounds:
+                break
+            server.modify(modify)
+    finally:
+        child.send_signal(signal.SIGTERM)
+        child.wait()
+    _report('watch', seconds, rounds, server)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-n', '--notes', type='int', default=20000)
+    parser.add_option('--latency', type='float', default=0.01)
+    parser.add_option('-j', '--jobs', type='int', default=4)
+    parser.add_option('--storage', default='journal')
+    parser.add_option('--modify', type='int', default=5)
+    parser.add_option('--rounds', type='int', default=5)
+    parser.add_option('--interval', type='float', default=1)
+    (options, args) = parser.parse_args()
+    server = StandInServer(options.notes, latency=options.latency).start()
+    work_dir = tempfile.mkdtemp()
+    env = dict(os.environ, LOGLEVEL='ERROR')
+    config_file = _write_config(
+        work_dir, server.url, options.jobs, options.storage)
+    with open(config_file, 'a') as fh:
+        fh.write('watch_jitter: 0\n')
+    command = [sys.executable, 'sn.py', '-q', '-c', config_file,
+               '-o', os.path.join(work_dir, 'out.json')]
+    try:
+        # fill the cache so both start from the same steady state
+        _measure(command + ['sync'], env)
+        print('{} notes, {}s latency, {} modified per sync'.format(
+            options.notes, options.latency, options.modify))
+        print('{:<8} {:>9} {:>7} {:>7} {:>7}'.format(
+            'run', 'seconds', 'logins', 'index', 'notes'))
+        run_cron(server, command, env, options.rounds, options.modify)
+        run_watch(server, command, env, options.rounds, options.modify,
+                  options.interval)
+    finally:
+        server.stop()
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,46 +14,452 @@ for note_meta in index['data']:
     note = sn.note(note_meta['key'])
     print note['content']
 
+Non-blocking usage:
+from simplenote import AsyncSimplenote
+asn = AsyncSimplenote(email, password, concurrency=8)
+asn.login().get()
+asn.full_index(callback=on_index)  # returns at once, on_index gets the index
+for note in asn.notes(keys):  # fetched concurrently, in completion order
+    print note['content']
+asn.close()
+
 """
 
 
-import urllib
-import urllib2
+import urlparse
+import time
 import base64
 import logging
 import json
+import random
+import bisect
+import copy
+import threading
+import zlib
+# urllib, httplib, socket and multiprocessing are imported where they are
+# used, so programs that only need Note and NoteMeta start quickly
 
 
-__all__ = ['Simplenote']
+__all__ = ['Simplenote', 'AsyncSimplenote', 'Note', 'NoteMeta']
 _logger = logging.getLogger(__name__)
+DEFAULT_SERVER = 'https://simple-note.appspot.com'
 
 
 class SimplenoteError(Exception):
-    pass
+    def __init__(self, msg, status=None):
+        """status is the http status code, None when no response was read."""
+        super(SimplenoteError, self).__init__(msg)
+        self.status = status
+
+
+_tags = {}
+
+
+def _intern_tags(tags):
+    """Returns tags as a tuple sharing one string object per distinct tag."""
+    return tuple(_tags.setdefault(tag, tag) for tag in tags)
+
+
+class NoteMeta(object):
+    """A note's metadata, as found in the index.
+
+    Fields are stored in __slots__ instead of a per note dictionary and tags
+    are tuples of shared strings. Fields can also be read like a dictionary,
+    note['key'], and fields the api didn't return are None.
+
+    """
+    __slots__ = (
+        'key', 'deleted', 'modifydate', 'createdate', 'syncnum', 'version',
+        'minversion', 'sharekey', 'publishkey', 'systemtags', 'tags')
+    _fields = __slots__
+
+    def __init__(self, **fields):
+        for name in NoteMeta.__slots__:
+            setattr(self, name, fields.get(name))
+        self.tags = _intern_tags(self.tags or ())
+        self.systemtags = _intern_tags(self.systemtags or ())
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create from a dictionary as returned by the api.
+
+        Unknown fields are ignored.
+
+        """
+        return cls(**data)
+
+    def to_dict(self):
+        """Dictionary in the same form as the api, for saving as JSON."""
+        data = {}
+        for name in self._fields:
+            value = getattr(self, name)
+            if isinstance(value, tuple):
+                data[name] = list(value)
+            elif value is not None:
+                data[name] = value
+        return data
+
+    def __getitem__(self, name):
+        if name not in self._fields:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def get(self, name, default=None):
+        if name not in self._fields:
+            return default
+        return getattr(self, name)
+
+    def __repr__(self):
+        return '<{} {}>'.format(type(self).__name__, self.key)
+
+
+class Note(NoteMeta):
+    """A full note, its metadata plus content.
+
+    The content is held as UTF-8 encoded bytes and only decoded when read.
+
+    """
+    __slots__ = ('_content',)
+    _fields = NoteMeta._fields + ('content',)
+
+    def __init__(self, **fields):
+        super(Note, self).__init__(**fields)
+        content = fields.get('content') or ''
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        self._content = content
+
+    @property
+    def content(self):
+        return self._content.decode('utf-8')
+
+
+class ConnectionPool(object):
+    """Keeps idle keep-alive HTTP(S) connections around for reuse.
+
+    Connections are keyed by scheme and host. At most maxsize idle
+    connections are kept per host and any that have been idle longer than
+    idle_timeout seconds are closed instead of reused. Safe to share between
+    threads, each request checks a connection out for its own use.
+
+    """
+    def __init__(self, maxsize=4, idle_timeout=60):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.opened = 0
+        self.reused = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _get(self, host):
+        """Returns (connection, reused) for host."""
+        now = time.time()
+        with self._lock:
+            idle = self._idle.get(host, [])
+            while idle:
+                conn, last_used = idle.pop()
+                if now - last_used <= self.idle_timeout:
+                    self.reused += 1
+                    return (conn, True)
+                conn.close()
+            self.opened += 1
+        return (self._connect(host), False)
+
+    @staticmethod
+    def _connect(host):
+        import httplib
+        if host[0] == 'https':
+            return httplib.HTTPSConnection(host[1])
+        return httplib.HTTPConnection(host[1])
+
+    def _put(self, host, conn):
+        with self._lock:
+            idle = self._idle.setdefault(host, [])
+            if len(idle) < self.maxsize:
+                idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def request(self, method, url, body=None, headers=None):
+        """Sends a request and returns (status, response body, encoding).
+
+        encoding is the Content-Encoding of the body, None if it has none.
+
+        A reused connection the server has already closed is retried once on
+        a fresh connection. Network errors are raised as socket.error or
+        httplib.HTTPException.
+
+        """
+        import httplib
+        import socket
+        parts = urlparse.urlsplit(url)
+        host = (parts.scheme, parts.netloc)
+        path = parts.path
+        if parts.query:
+            path += '?' + parts.query
+        while True:
+            conn, reused = self._get(host)
+            try:
+                conn.request(method, path, body, headers or {})
+                response = conn.getresponse()
+                data = response.read()
+            except (socket.error, httplib.HTTPException):
+                conn.close()
+                if reused:
+                    _logger.debug('stale connection to %s, retrying', host[1])
+                    continue
+                raise
+            break
+        if response.will_close:
+            conn.close()
+        else:
+            self._put(host, conn)
+        return (response.status, data, response.getheader('Content-Encoding'))
+
+    def close(self):
+        """Closes every idle connection."""
+        with self._lock:
+            for idle in self._idle.values():
+                for conn, _ in idle:
+                    conn.close()
+            self._idle = {}
+
+
+class RequestStats(object):
+    """Latency histogram, response sizes and errors for each endpoint.
+
+    Every attempt is recorded, so a retried request is counted each time it
+    is sent. Latency buckets are upper bounds in seconds, the last count in
+    a histogram is for requests slower than every bound.
+
+    """
+    buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self.endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, size, status):
+        """Record one request, status is None when no response was read."""
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = {
+                    'requests': 0,
+                    'errors': 0,
+                    'bytes': 0,
+                    'seconds': 0.0,
+                    'max_seconds': 0.0,
+                    'latency_buckets': list(self.buckets),
+                    'latency_counts': [0] * (len(self.buckets) + 1),
+                }
+            stats['requests'] += 1
+            if status is None or not 200 <= status < 300:
+                stats['errors'] += 1
+            stats['bytes'] += size
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            stats['latency_counts'][bucket] += 1
+
+    def to_dict(self):
+        with self._lock:
+            return copy.deepcopy(self.endpoints)
+
+
+class RequestScheduler(object):
+    """Rate limits requests and retries the ones that fail temporarily.
+
+    Requests take a token from a bucket that refills at rate per second and
+    holds up to burst tokens. Throttled (429) and server (5xx) responses and
+    network errors are retried up to retries times, waiting a random time
+    up to an exponentially growing delay between attempts. The number of
+    requests allowed in flight at once starts at max_concurrency, is halved
+    when a request fails like this and grows back by one for about every
+    limit requests that succeed.
+
+    """
+    def __init__(self, rate=None, burst=None, retries=3, backoff=0.5,
+                 max_backoff=30, max_concurrency=4):
+        """Sets up the scheduler.
+
+        rate (default: None): Requests per second, None for no limit
+        burst (default: rate): Requests that can be sent at once after idling
+        retries (default: 3): Extra attempts for a temporary failure
+        backoff (default: 0.5): Seconds to wait before the first retry
+        max_backoff (default: 30): Longest wait between attempts
+        max_concurrency (default: 4): Most requests in flight at once
+
+        """
+        self.rate = rate
+        self.burst = burst or rate or 1
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)
+        self.retry_count = 0
+        self.throttle_count = 0
+        self._tokens = float(self.burst)
+        self._stamp = time.time()
+        self._active = 0
+        self._bucket_lock = threading.Lock()
+        self._slots = threading.Condition()
+
+    def _take_token(self):
+        if self.rate is None:
+            return
+        with self._bucket_lock:
+            now = time.time()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            # going below zero reserves the next token for this request
+            self._tokens -= 1
+            wait = -self._tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+    def _acquire(self):
+        with self._slots:
+            while self._active >= int(self.limit):
+                self._slots.wait()
+            self._active += 1
+
+    def _release(self, ok):
+        with self._slots:
+            self._active -= 1
+            if ok:
+                self.limit = min(
+                    self.max_concurrency, self.limit + 1 / self.limit)
+            else:
+                self.limit = max(1.0, self.limit / 2)
+            self._slots.notify_all()
+
+    @staticmethod
+    def retryable(error):
+        """True for network errors, throttling and server errors."""
+        return (
+            error.status is None or error.status == 429 or error.status >= 500)
+
+    def call(self, func, *args):
+        """Calls func(*args), which raises SimplenoteError on failure."""
+        attempt = 0
+        while True:
+            self._take_token()
+            self._acquire()
+            try:
+                result = func(*args)
+            except SimplenoteError as e:
+                retry = self.retryable(e)
+                self._release(ok=not retry)
+                if not retry or attempt >= self.retries:
+                    raise
+                with self._bucket_lock:
+                    if e.status == 429:
+                        self.throttle_count += 1
+                    self.retry_count += 1
+                delay = random.uniform(
+                    0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                _logger.debug('%s, retrying in %.2f seconds', e, delay)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self._release(ok=True)
+            return result
 
 
 class Simplenote(object):
     """The core Simplenote class."""
-    def __init__(self, email, password):
+    def __init__(self, email, password, pool_size=4, idle_timeout=60,
+                 rate=None, retries=3, server=DEFAULT_SERVER, compress=True):
         """Sets up initial variables.
 
         email: The users' email address
         password: The users' password
+        pool_size (default: 4): Idle connections to keep open for reuse,
+            set this to at least the number of threads using the client.
+            This is also the most requests that are sent at once
+        idle_timeout (default: 60): Seconds an idle connection is reused for
+        rate (default: None): Most requests per second, None for no limit
+        retries (default: 3): Times to retry a request that failed because
+            of throttling, a server error or a network error
+        server (default: DEFAULT_SERVER): Scheme and host of the api
+        compress (default: True): Ask for gzip compressed responses, they
+            are decompressed before being returned
 
         """
         _logger.debug('Entered Simplenote()')
-        self.base_url = 'https://simple-note.appspot.com/api2/'
+        self.base_url = server + '/api2/'
+        # the login url is just api, not api2
+        self.login_url = server + '/api/login'
         self.email = email
         self.password = password
         self.authtok = ''
         self.api_count = 0
+        self._count_lock = threading.Lock()
+        self.pool = ConnectionPool(pool_size, idle_timeout)
+        self.scheduler = RequestScheduler(
+            rate=rate, retries=retries, max_concurrency=pool_size)
+        self.stats = RequestStats()
+        self.compress = compress
+
+    @property
+    def connections_opened(self):
+        """Number of new connections made to the server."""
+        return self.pool.opened
+
+    @property
+    def connections_reused(self):
+        """Number of requests sent over an already open connection."""
+        return self.pool.reused
+
+    @property
+    def retry_count(self):
+        """Number of requests that were retried."""
+        return self.scheduler.retry_count
+
+    def _request(self, method, url, body=None, headers=None):
+        """Sends a request through the scheduler and connection pool.
+
+        Returns the response body, raises SimplenoteError on a non 2xx
+        status or network error once any retries are used up.
+
+        """
+        return self.scheduler.call(self._send, method, url, body, headers)
+
+    def _send(self, method, url, body, headers):
+        import httplib
+        import socket
+        # endpoint is the part after api/ or api2/, without the note key
+        endpoint = urlparse.urlsplit(url).path.split('/')[2]
+        if self.compress:
+            headers = dict(headers or {}, **{'Accept-Encoding': 'gzip'})
+        start = time.time()
+        try:
+            status, response, encoding = self.pool.request(
+                method, url, body, headers)
+        except (socket.error, httplib.HTTPException), e:
+            self.stats.record(endpoint, time.time() - start, 0, None)
+            # Non http error, like network issue
+            raise SimplenoteError('url error: {}'.format(e))
+        # bytes as sent over the network, before decompressing
+        self.stats.record(endpoint, time.time() - start, len(response), status)
+        if not 200 <= status < 300:
+            raise SimplenoteError('http error: {}'.format(status), status)
+        if encoding == 'gzip':
+            try:
+                response = zlib.decompress(response, 16 + zlib.MAX_WBITS)
+            except zlib.error, e:
+                raise SimplenoteError('bad gzip response: {}'.format(e))
+        return response
 
     def _process_query(self, url, query=None, add_authtok=True):
         """Processes the given url and query dictionary
 
         It's assumed all calls are GET requests and data is returned
         in JSON format. Increments api_count each time it's run.
-        Returns False on error.
+        Raises SimplenoteError on error.
 
         url: The full url
         query (optional): Key, value dictionary with query variables.
@@ -61,10 +467,10 @@ class Simplenote(object):
             query string
 
         """
+        import urllib
         if add_authtok:
             if self.authtok == '':
-                self._error('No auth token, must login first')
-                return False
+                raise SimplenoteError('No auth token, must login first')
             if query is None:
                 query = {}
             query.update({'auth': self.authtok, 'email': self.email})
@@ -74,43 +480,26 @@ class Simplenote(object):
         else:
             request = url
 
-        self.api_count += 1
-        try:
-            fh = urllib2.urlopen(request)
-            response = fh.read()
-            fh.close()
-        except urllib2.HTTPError, e:
-            # Received a non 2xx status code
-            raise SimplenoteError('http error: {}'.format(e.code))
-        except urllib2.URLError, e:
-            # Non http error, like network issue
-            raise SimplenoteError('url error: {}'.format(e.reason))
+        with self._count_lock:
+            self.api_count += 1
+        response = self._request('GET', request)
         return json.loads(response)
 
     def login(self):
         """Logs in to Simplenote. Required before other methods.
 
-        Returns False on error, True if successful.
+        Returns True if successful, raises SimplenoteError on error.
 
         """
-        # the login url is just api, not api2
-        url = 'https://simple-note.appspot.com/api/login'
+        import urllib
         query = {'email': self.email, 'password': self.password}
         data = base64.b64encode(urllib.urlencode(query))
-        try:
-            fh = urllib2.urlopen(url, data)
-            self.authtok = fh.read()
-        except urllib2.HTTPError, e:
-            # Received a non 2xx status code
-            raise SimplenoteError('http error: {}'.format(e.code))
-        except urllib2.URLError, e:
-            # Non http error, like network issue
-            raise SimplenoteError('url error: {}'.format(e.reason))
-        fh.close()
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        self.authtok = self._request('POST', self.login_url, data, headers)
         return True
 
     def note(self, key=None):
-        """Retreives a single note.
+        """Retreives a single note as a Note object.
 
         key: The note's key (can be obtained from index call)
 
@@ -119,35 +508,129 @@ class Simplenote(object):
             raise SimplenoteError('Unable to get note: Key not given')
         url = self.base_url + 'data/' + key
         note = self._process_query(url)
-        return note
+        return Note.from_dict(note)
 
     def delete(self):
         raise NotImplementedError()
 
-    def index(self, length=100, mark=None):
+    def index(self, length=100, mark=None, since=None):
         """Retrieves index of notes.
 
         length: How many to retreive, defaults to 100 (max)
         mark: Get the next batch of notes.
+        since: Only notes modified after this time, in seconds since the
+            epoch like modifydate
+
+        The notes in index['data'] are NoteMeta objects.
 
         """
         url = self.base_url + 'index'
         query = {'length': length}
         if mark is not None:
             query.update({'mark': mark})
+        if since is not None:
+            query.update({'since': '{:.6f}'.format(since)})
         index = self._process_query(url, query)
+        index['data'] = [NoteMeta.from_dict(note) for note in index['data']]
         return index
 
+    def iter_index(self, length=100):
+        """Retrieves the index of notes one page at a time.
+
+        Yields the list of notes in each page as soon as it arrives, so the
+        caller can start working on it before the next page is requested.
+
+        length: How many to retreive per page, defaults to 100 (max)
+
+        """
+        for page, mark in self.index_pages(length):
+            yield page
+
+    def index_pages(self, length=100, mark=None, since=None):
+        """Like iter_index() but yields (notes, mark) for each page.
+
+        mark is what to pass to index() for the following page, None after
+        the last page. Passing it back in as mark, with the same since,
+        carries on from there.
+
+        since: Only notes modified after this time, see index()
+
+        """
+        while True:
+            index = self.index(length, mark, since)
+            mark = index.get('mark')
+            yield (index['data'], mark)
+            if mark is None:
+                return
+
     def full_index(self):
         """Retrieves full index of notes."""
-        index = self.index()
         full_index = []
-        for note in index['data']:
-            full_index.append(note)
-        while 'mark' in index:
-            mark = index['mark']
-            index = ''
-            index = self.index(mark=mark)
-            for note in index['data']:
-                full_index.append(note)
+        for page in self.iter_index():
+            full_index.extend(page)
         return full_index
+
+
+class AsyncSimplenote(object):
+    """Non-blocking Simplenote client for event driven programs.
+
+    Python 2 has no asyncio so requests run on a fixed pool of worker
+    threads that share one Simplenote client and its connection pool. Every
+    method returns a multiprocessing.pool.AsyncResult straight away. Either
+    call get() on it, or pass callback which is called with the result on a
+    worker thread; hand it back to your event loop from there. Errors are
+    raised by get() and the callback is not called. At most concurrency
+    requests are in flight at once, the rest wait in the queue.
+
+    """
+    def __init__(self, email, password, concurrency=8, idle_timeout=60):
+        """Sets up the client and worker pool.
+
+        email: The users' email address
+        password: The users' password
+        concurrency (default: 8): How many requests can run at once
+        idle_timeout (default: 60): Seconds an idle connection is reused for
+
+        """
+        from multiprocessing.pool import ThreadPool
+        self.client = Simplenote(
+            email, password, pool_size=concurrency, idle_timeout=idle_timeout)
+        self._workers = ThreadPool(concurrency)
+
+    def _submit(self, func, args=(), callback=None):
+        return self._workers.apply_async(func, args, callback=callback)
+
+    def login(self, callback=None):
+        """Logs in to Simplenote. Required before other methods."""
+        return self._submit(self.client.login, callback=callback)
+
+    def index(self, length=100, mark=None, callback=None):
+        """Retrieves index of notes. See Simplenote.index()."""
+        return self._submit(self.client.index, (length, mark), callback)
+
+    def full_index(self, callback=None):
+        """Retrieves full index of notes."""
+        return self._submit(self.client.full_index, callback=callback)
+
+    def note(self, key, callback=None):
+        """Retreives a single note."""
+        return self._submit(self.client.note, (key,), callback)
+
+    def notes(self, keys):
+        """Retrieves many notes concurrently.
+
+        Returns an iterator of notes in the order they finish downloading.
+        A failed note raises SimplenoteError when it is reached.
+
+        """
+        return self._workers.imap_unordered(self.client.note, keys)
+
+    @property
+    def api_count(self):
+        return self.client.api_count
+
+    def close(self):
+        """Waits for queued requests then closes workers and connections."""
+        self._workers.close()
+        self._workers.join()
+        self.client.pool.close()
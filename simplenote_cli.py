@@ -0,0 +1,2209 @@
+# vim:ts=4:sw=4:ft=python:fileencoding=utf-8
+"""Simplenote CLI
+
+Command line interface to simplenote, run with sn.py.
+
+"""
+import sys
+import os
+import errno
+from optparse import OptionParser
+from ConfigParser import RawConfigParser
+import json
+import hashlib
+import re
+import math
+import logging
+import time
+from collections import namedtuple, defaultdict, deque
+from contextlib import contextmanager
+import Queue
+
+# modules only some commands need (xml.etree, datetime, sqlite3,
+# multiprocessing, util.appdirs, util.search and the networking parts of
+# simplenote) are imported where they are used to keep startup quick
+from simplenote import Note, NoteMeta, _intern_tags
+import util.progress_bar as pb
+from util.compress import (
+    get_codec, compress, decompress, encode_line, decode_line)
+
+
+__version__ = '0.4.0-dev'
+
+
+def _xml_chars(chars):
+    """Regex matching the characters in class chars or a lone surrogate.
+
+    Surrogates not in a pair get through json.loads() from \\u escapes and
+    can't be encoded as valid UTF-8. A pair is one character on wide builds
+    but two on narrow ones, where it is left alone.
+    """
+    if sys.maxunicode > 0xffff:
+        return re.compile(u'[' + chars + u'\ud800-\udfff]')
+    return re.compile(u'[' + chars + u']|[\ud800-\udbff](?![\udc00-\udfff])|'
+                      u'(?<![\ud800-\udbff])[\udc00-\udfff]')
+
+
+# characters note_xml() replaces, with the ones XML 1.0 can't hold, control
+# characters other than tab and newlines, dropped
+_XML_SPECIAL = _xml_chars(u'&<>\r\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff')
+_XML_ESCAPES = {u'&': u'&amp;', u'<': u'&lt;', u'>': u'&gt;', u'\r': u'&#13;'}
+
+
+class ConfigError(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return repr(self.msg)
+
+
+class PhaseTimer(object):
+    """Adds up the wall time spent in named phases of a run.
+
+    Downloads overlap the index phase, so the fetch phase is only the time
+    spent waiting for downloads after the last index page. Cache saves are
+    counted in cache_save as well as the phase they happened in.
+
+    """
+    def __init__(self):
+        self.phases = defaultdict(float)
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.time() - start
+
+
+def _dumps(obj):
+    """json.dumps that also serializes Note and NoteMeta objects."""
+    return json.dumps(obj, default=NoteMeta.to_dict)
+
+
+def _rename_over(source, target):
+    """Rename source to target, replacing target in one step if it exists."""
+    if os.name != 'nt':
+        os.rename(source, target)
+        return
+    # os.rename won't replace a file on windows and removing it first would
+    # leave a moment with neither
+    import ctypes
+    replace_existing, write_through = 0x1, 0x8
+    if not ctypes.windll.kernel32.MoveFileExW(
+            _unicode_path(source), _unicode_path(target),
+            replace_existing | write_through):
+        raise ctypes.WinError()
+
+
+def _unicode_path(path):
+    if isinstance(path, unicode):
+        return path
+    return path.decode(sys.getfilesystemencoding())
+
+
+def _replace_file(filename, write):
+    """Replace filename with what write(file object) writes, atomically.
+
+    It is written to a temporary file next to it first, synced to disk and
+    renamed over filename, so a crash leaves either the old or the new file
+    and never one half written.
+    """
+    tmp_file = filename + '.tmp'
+    with open(tmp_file, 'wb') as fh:
+        write(fh)
+        fh.flush()
+        os.fsync(fh.fileno())
+    _rename_over(tmp_file, filename)
+
+
+class ChangeSet(namedtuple('ChangeSet', 'added modified deleted')):
+    """Note keys that differ between the cache and the index."""
+    __slots__ = ()
+
+    @property
+    def changed(self):
+        """Keys that need to be downloaded."""
+        return self.added + self.modified
+
+
+class NoteFilter(namedtuple('NoteFilter', 'tags systemtags after before')):
+    """Which notes to read from a cache, by their metadata alone.
+
+    tags, systemtags: Tags a note must all have
+    after, before: Range of modifydate, after included, None for no limit
+    """
+    __slots__ = ()
+
+    def match_fields(self, modifydate, tags, systemtags):
+        if self.after is not None and modifydate < self.after:
+            return False
+        if self.before is not None and modifydate >= self.before:
+            return False
+        return (all(tag in tags for tag in self.tags) and
+                all(tag in systemtags for tag in self.systemtags))
+
+    def match(self, note):
+        """True if note, or its NoteMeta, passes the filter."""
+        return self.match_fields(
+            float(note.modifydate), note.tags, note.systemtags)
+
+
+class NoteCache(object):
+    """Interface for note cache storage backends.
+
+    A backend stores Note objects, as returned by Simplenote.note(), by note
+    key. Changes made with put and remove are persisted by save_cache
+    and compact.
+
+    """
+    def diff(self, index, partial=False):
+        """Compare the cache with an index without changing the cache.
+
+        The index is walked once, looking up each note with syncnum().
+
+        partial (default: False): index is only part of the full index, such
+            as a single page, so no notes are reported as deleted
+
+        @return ChangeSet of added, modified and deleted note keys
+        """
+        added = []
+        modified = []
+        seen = set()
+        for note in index:
+            key = note.key
+            seen.add(key)
+            syncnum = self.syncnum(key)
+            if syncnum is None:
+                self._log.debug('found new note %s', key)
+                added.append(key)
+            elif syncnum != note.syncnum:
+                self._log.debug(
+                    'note %s syncnum %s differs from index syncnum %s',
+                    key,
+                    syncnum,
+                    note.syncnum)
+                modified.append(key)
+        deleted = [] if partial else self.missing(seen)
+        return ChangeSet(added, modified, deleted)
+
+    def syncnum(self, key):
+        """Returns the syncnum of the cached note or None if not cached."""
+        raise NotImplementedError()
+
+    def missing(self, keys):
+        """Returns keys of cached notes that are not in keys."""
+        raise NotImplementedError()
+
+    def get(self, key):
+        """Returns the note for key or None."""
+        raise NotImplementedError()
+
+    def put(self, key, note):
+        """Add or replace a note."""
+        raise NotImplementedError()
+
+    def remove(self, key):
+        """Remove a note."""
+        raise NotImplementedError()
+
+    def notes(self, include_deleted=False, where=None):
+        """Iterate over cached notes, skipping ones in the trash by default.
+
+        where (default: None): NoteFilter, checked before reading the rest
+            of the note where the backend can
+        """
+        raise NotImplementedError()
+
+    def save_cache(self):
+        """Persist changes since the last save."""
+        raise NotImplementedError()
+
+    def compact(self):
+        """Persist all changes in their final form, used at the end of a run."""
+        raise NotImplementedError()
+
+
+class SimpleNoteCache(NoteCache):
+    """Local copy of every note, keyed by note key.
+
+    The cache is stored as a cache.json snapshot. In journal mode save_cache
+    only appends the notes changed since the last save to cache.journal and
+    the snapshot is rewritten by compact(), normally at the end of a run.
+    Any journal left over is replayed on top of the snapshot when loading.
+
+    With a codec from util.compress the snapshot and journal records are
+    compressed. Either is read back whether it was compressed or not.
+
+    """
+    def __init__(self, cache_dir, journal=False, codec=None):
+        self._log = logging.getLogger('sn.SimpleNoteCache')
+        self.cache_dir = cache_dir
+        self.cache_file = os.path.join(self.cache_dir, 'cache.json')
+        self.journal_file = os.path.join(self.cache_dir, 'cache.journal')
+        self.journal = journal
+        self.codec = codec
+        self._pending = {}
+        self._load_cache()
+        self._replay_journal()
+
+    def _load_cache(self, call_count=1):
+        self._log.debug(
+            'Loading cache from %s. Attempt %s',
+            self.cache_file,
+            call_count)
+        try:
+            with open(self.cache_file, 'rb') as fh:
+                cache = json.loads(decompress(fh.read()))
+            # values replaced in place as a new dict could iterate, and so
+            # export, the notes in a different order
+            for key in cache:
+                cache[key] = Note.from_dict(cache[key])
+            self.cache = cache
+        except IOError as exc:
+            if call_count > 2:
+                self._log.critical('loading cache failed 3 times. giving up')
+                raise
+            if errno.errorcode[exc.errno] == 'ENOENT':
+                self._log.info('cache file does not exist. creating')
+                self.cache = {}
+                self.compact()
+                self._load_cache(call_count=call_count + 1)
+            else:
+                raise
+
+    def _replay_journal(self):
+        """Apply records from the journal on top of the loaded snapshot.
+
+        A damaged record, from a crash part way through a write, ends the
+        replay and the cache is compacted straight away so later records are
+        not appended after it.
+        """
+        try:
+            fh = open(self.journal_file, 'rb')
+        except IOError as exc:
+            if errno.errorcode[exc.errno] == 'ENOENT':
+                return
+            raise
+        self._log.debug('replaying journal %s', self.journal_file)
+        damaged = False
+        with fh:
+            for line in fh:
+                try:
+                    record = json.loads(decode_line(line))
+                except ValueError:
+                    self._log.warning('ignoring damaged journal record')
+                    damaged = True
+                    break
+                if record['note'] is None:
+                    self.cache.pop(record['key'], None)
+                else:
+                    self.cache[record['key']] = Note.from_dict(record['note'])
+        if damaged:
+            self.compact()
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def put(self, key, note):
+        self.cache[key] = note
+        self._pending[key] = note
+
+    def remove(self, key):
+        del self.cache[key]
+        self._pending[key] = None
+
+    def notes(self, include_deleted=False, where=None):
+        for note in self.cache.itervalues():
+            if ((include_deleted or note.deleted != 1) and
+                    (where is None or where.match(note))):
+                yield note
+
+    def save_cache(self):
+        """Persist changes since the last save.
+
+        In journal mode only the changed notes are written, otherwise the
+        whole snapshot is rewritten. Nothing is written if nothing changed.
+        """
+        if not self._pending and os.path.exists(self.cache_file):
+            return
+        if self.journal and os.path.exists(self.cache_file):
+            self._append_journal()
+        else:
+            self.compact()
+
+    def _append_journal(self):
+        if not self._pending:
+            return
+        self._log.debug(
+            'appending %s notes to %s',
+            len(self._pending),
+            self.journal_file)
+        with open(self.journal_file, 'ab') as fh:
+            for key, note in self._pending.iteritems():
+                fh.write(encode_line(
+                    _dumps({'key': key, 'note': note}), self.codec) + '\n')
+            fh.flush()
+            os.fsync(fh.fileno())
+        self._pending = {}
+
+    def compact(self, call_count=1):
+        """Rewrite the snapshot with the whole cache and drop the journal.
+
+        The snapshot is replaced with _replace_file() so a crash never
+        leaves a half written cache.json.
+        """
+        self._log.debug(
+            'saving cache to %s. Attempt %s',
+            self.cache_file,
+            call_count)
+        try:
+            _replace_file(self.cache_file, lambda fh: fh.write(
+                compress(_dumps(self.cache), self.codec)))
+        except IOError as exc:
+            if call_count > 2:
+                self._log.critical('saving cache failed 3 times. giving up')
+                raise
+            if errno.errorcode[exc.errno] == 'ENOENT':
+                self._log.info('creating new cache file %s', self.cache_file)
+                os.makedirs(self.cache_dir)
+                self.compact(call_count=call_count + 1)
+                return
+            else:
+                raise
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+        self._pending = {}
+
+    def syncnum(self, key):
+        note = self.cache.get(key)
+        if note is None:
+            return None
+        return note.syncnum
+
+    def missing(self, keys):
+        return [key for key in self.cache if key not in keys]
+
+
+class SqliteNoteCache(NoteCache):
+    """Note cache stored in a SQLite database.
+
+    Notes are kept on disk as JSON, along with indexed syncnum, modifydate
+    and deleted columns and a table of their tags, so only the notes being
+    worked on are held in memory and notes() can pick out notes by tag and
+    date in SQL. The first time the database is created an existing
+    cache.json, and any journal, is imported in to it.
+
+    With a codec from util.compress each note is stored compressed, as a
+    blob instead of text.
+
+    """
+    def __init__(self, cache_dir, codec=None):
+        self._log = logging.getLogger('sn.SqliteNoteCache')
+        self.cache_dir = cache_dir
+        self.codec = codec
+        self.cache_file = os.path.join(self.cache_dir, 'cache.sqlite')
+        if not os.path.isdir(self.cache_dir):
+            self._log.info('creating cache directory %s', self.cache_dir)
+            os.makedirs(self.cache_dir)
+        import sqlite3
+        exists = os.path.exists(self.cache_file)
+        self._log.debug('opening cache %s', self.cache_file)
+        self.db = sqlite3.connect(self.cache_file)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS notes (
+                key TEXT PRIMARY KEY,
+                syncnum INTEGER NOT NULL,
+                modifydate REAL NOT NULL,
+                deleted INTEGER NOT NULL,
+                data TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS notes_syncnum ON notes (syncnum);
+            CREATE INDEX IF NOT EXISTS notes_modifydate ON notes (modifydate);
+            CREATE INDEX IF NOT EXISTS notes_deleted ON notes (deleted);
+            CREATE TABLE IF NOT EXISTS tags (
+                tag TEXT NOT NULL,
+                system INTEGER NOT NULL,
+                key TEXT NOT NULL,
+                PRIMARY KEY (tag, system, key));
+            CREATE INDEX IF NOT EXISTS tags_key ON tags (key);
+        ''')
+        if not exists:
+            self._migrate()
+        elif self.db.execute('PRAGMA user_version').fetchone()[0] < 1:
+            self._add_tags()
+        self.db.execute('PRAGMA user_version = 1')
+
+    def _migrate(self):
+        """Import notes from a json cache in the same directory."""
+        json_cache = os.path.join(self.cache_dir, 'cache.json')
+        if not os.path.exists(json_cache):
+            return
+        self._log.info('importing %s in to %s', json_cache, self.cache_file)
+        old = SimpleNoteCache(self.cache_dir)
+        for note in old.notes(include_deleted=True):
+            self.put(note.key, note)
+        self.db.commit()
+
+    def _add_tags(self):
+        """Fill the tags table of a cache made before there was one."""
+        self._log.info('adding tags to %s', self.cache_file)
+        for row in self.db.execute('SELECT data FROM notes').fetchall():
+            self._put_tags(self._load(row[0]))
+        self.db.commit()
+
+    def _put_tags(self, note):
+        self.db.execute('DELETE FROM tags WHERE key = ?', (note.key,))
+        self.db.executemany(
+            'INSERT OR IGNORE INTO tags VALUES (?, ?, ?)',
+            [(tag, 0, note.key) for tag in note.tags] +
+            [(tag, 1, note.key) for tag in note.systemtags])
+
+    @contextmanager
+    def _temp_index(self, rows):
+        """Load (key, syncnum) rows in to a temporary idx table."""
+        self.db.execute(
+            'CREATE TEMP TABLE idx (key TEXT PRIMARY KEY, syncnum INTEGER)')
+        try:
+            self.db.executemany('INSERT OR REPLACE INTO idx VALUES (?, ?)', rows)
+            yield self.db
+        finally:
+            self.db.execute('DROP TABLE idx')
+
+    def _select_missing(self):
+        return [row[0] for row in self.db.execute(
+            'SELECT key FROM notes WHERE key NOT IN (SELECT key FROM idx)')]
+
+    def diff(self, index, partial=False):
+        """Compare the cache with an index using a temporary table."""
+        rows = ((note.key, note.syncnum) for note in index)
+        with self._temp_index(rows) as db:
+            added = [row[0] for row in db.execute(
+                'SELECT idx.key FROM idx LEFT JOIN notes USING (key) '
+                'WHERE notes.key IS NULL')]
+            modified = [row[0] for row in db.execute(
+                'SELECT key FROM idx JOIN notes USING (key) '
+                'WHERE idx.syncnum != notes.syncnum')]
+            deleted = [] if partial else self._select_missing()
+        return ChangeSet(added, modified, deleted)
+
+    def missing(self, keys):
+        with self._temp_index((key, None) for key in keys):
+            return self._select_missing()
+
+    def get(self, key):
+        row = self.db.execute(
+            'SELECT data FROM notes WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return self._load(row[0])
+
+    @staticmethod
+    def _load(data):
+        if isinstance(data, buffer):
+            data = decompress(str(data))
+        return Note.from_dict(json.loads(data))
+
+    def put(self, key, note):
+        data = _dumps(note)
+        if self.codec is not None:
+            data = buffer(compress(data, self.codec))
+        self.db.execute(
+            'INSERT OR REPLACE INTO notes VALUES (?, ?, ?, ?, ?)',
+            (key,
+             note.syncnum,
+             float(note.modifydate),
+             note.deleted,
+             data))
+        self._put_tags(note)
+
+    def remove(self, key):
+        self.db.execute('DELETE FROM notes WHERE key = ?', (key,))
+        self.db.execute('DELETE FROM tags WHERE key = ?', (key,))
+
+    @staticmethod
+    def _where(include_deleted, where):
+        """SQL conditions and their arguments for notes()."""
+        conditions = []
+        args = []
+        if not include_deleted:
+            conditions.append('deleted != 1')
+        if where is not None:
+            if where.after is not None:
+                conditions.append('modifydate >= ?')
+                args.append(where.after)
+            if where.before is not None:
+                conditions.append('modifydate < ?')
+                args.append(where.before)
+            for system, tags in ((0, where.tags), (1, where.systemtags)):
+                for tag in tags:
+                    conditions.append(
+                        'key IN (SELECT key FROM tags '
+                        'WHERE tag = ? AND system = ?)')
+                    args.extend([tag, system])
+        return (conditions, args)
+
+    def notes(self, include_deleted=False, where=None):
+        query = 'SELECT data FROM notes'
+        conditions, args = self._where(include_deleted, where)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        for row in self.db.execute(query, args):
+            yield self._load(row[0])
+
+    def save_cache(self):
+        self.db.commit()
+
+    def compact(self):
+        self.db.commit()
+
+
+class LowMemoryNoteCache(NoteCache):
+    """Note cache that only keeps note metadata in memory.
+
+    Notes are appended to cache.notes, one JSON record per line in the same
+    form as the journal. Only the key, syncnum, deleted flag, file offset,
+    modifydate and tags of the latest record for each note are held in
+    memory, enough for notes() to pick out notes by tag and date before
+    reading them. Note bodies are read back from disk when asked for, so
+    memory use follows the number of notes rather than their size.
+    compact() rewrites the file once enough of it is taken up by replaced or
+    removed notes.
+
+    With a codec from util.compress each record is compressed on its own,
+    so a single note can still be read back without reading its neighbours.
+
+    """
+    def __init__(self, cache_dir, codec=None):
+        self._log = logging.getLogger('sn.LowMemoryNoteCache')
+        self.cache_dir = cache_dir
+        self.codec = codec
+        self.cache_file = os.path.join(self.cache_dir, 'cache.notes')
+        if not os.path.isdir(self.cache_dir):
+            self._log.info('creating cache directory %s', self.cache_dir)
+            os.makedirs(self.cache_dir)
+        # key: (syncnum, deleted, offset, modifydate, tags, systemtags)
+        self.meta = {}
+        self._stale = 0
+        exists = os.path.exists(self.cache_file)
+        self._fh = open(self.cache_file, 'a+b')
+        self._scan()
+        if not exists:
+            self._migrate()
+
+    def _scan(self):
+        """Build the metadata index from the notes file a line at a time.
+
+        A damaged last record, from a crash part way through a write, is cut
+        off the end of the file.
+        """
+        self._log.debug('scanning %s', self.cache_file)
+        fh = self._fh
+        fh.seek(0)
+        offset = 0
+        for line in iter(fh.readline, ''):
+            try:
+                record = json.loads(decode_line(line))
+            except ValueError:
+                self._log.warning('dropping damaged record at %s', offset)
+                fh.truncate(offset)
+                break
+            self._index(record['key'], record['note'], offset)
+            offset += len(line)
+
+    def _index(self, key, note, offset):
+        if key in self.meta:
+            self._stale += 1
+        if note is None:
+            self.meta.pop(key, None)
+            self._stale += 1
+        else:
+            self.meta[key] = (
+                note['syncnum'], note['deleted'], offset,
+                float(note['modifydate']),
+                _intern_tags(note['tags']), _intern_tags(note['systemtags']))
+
+    def _migrate(self):
+        """Import notes from a json cache in the same directory."""
+        json_cache = os.path.join(self.cache_dir, 'cache.json')
+        if not os.path.exists(json_cache):
+            return
+        self._log.info('importing %s in to %s', json_cache, self.cache_file)
+        for note in SimpleNoteCache(self.cache_dir).notes(include_deleted=True):
+            self.put(note.key, note)
+        self.save_cache()
+
+    def _read(self, offset):
+        self._fh.seek(offset)
+        return Note.from_dict(
+            json.loads(decode_line(self._fh.readline()))['note'])
+
+    def _append(self, key, note):
+        self._fh.seek(0, os.SEEK_END)
+        offset = self._fh.tell()
+        self._fh.write(
+            encode_line(_dumps({'key': key, 'note': note}), self.codec) + '\n')
+        self._index(key, note, offset)
+
+    def syncnum(self, key):
+        meta = self.meta.get(key)
+        if meta is None:
+            return None
+        return meta[0]
+
+    def missing(self, keys):
+        return [key for key in self.meta if key not in keys]
+
+    def get(self, key):
+        meta = self.meta.get(key)
+        if meta is None:
+            return None
+        return self._read(meta[2])
+
+    def put(self, key, note):
+        self._append(key, note)
+
+    def remove(self, key):
+        self._append(key, None)
+
+    def notes(self, include_deleted=False, where=None):
+        # read in file order so the disk is read sequentially
+        offsets = sorted(
+            meta[2] for meta in self.meta.itervalues()
+            if (include_deleted or meta[1] != 1) and
+            (where is None or where.match_fields(*meta[3:])))
+        for offset in offsets:
+            yield self._read(offset)
+
+    def save_cache(self):
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+    def compact(self):
+        """Save changes, rewriting the file if over a quarter is stale."""
+        self.save_cache()
+        if self._stale * 4 <= len(self.meta) + self._stale:
+            return
+        self._log.debug('rewriting %s', self.cache_file)
+        meta = {}
+
+        def write(fh):
+            for key, entry in sorted(
+                    self.meta.iteritems(), key=lambda item: item[1][2]):
+                meta[key] = entry[:2] + (fh.tell(),) + entry[3:]
+                self._fh.seek(entry[2])
+                fh.write(self._fh.readline())
+            # windows won't rename over a file that is open
+            self._fh.close()
+        _replace_file(self.cache_file, write)
+        self._fh = open(self.cache_file, 'a+b')
+        self.meta = meta
+        self._stale = 0
+
+
+def open_cache(cache_dir, storage='json', compression='none'):
+    """Open the note cache using the named storage backend.
+
+    storage: json, journal, sqlite or lowmem
+    compression: none, zlib or fast, see util.compress
+
+    @raises ConfigError() for an unknown storage type or compression
+    """
+    try:
+        codec = get_codec(compression)
+    except ValueError as exc:
+        raise ConfigError(str(exc))
+    if storage == 'sqlite':
+        return SqliteNoteCache(cache_dir, codec)
+    if storage == 'lowmem':
+        return LowMemoryNoteCache(cache_dir, codec)
+    if storage in ('json', 'journal'):
+        return SimpleNoteCache(
+            cache_dir, journal=storage == 'journal', codec=codec)
+    raise ConfigError('unknown storage type {}'.format(storage))
+
+
+def _xml_escape(value):
+    """value as escaped UTF-8 XML text, in one pass over it."""
+    if isinstance(value, str):
+        value = value.decode('utf-8', 'replace')
+    elif not isinstance(value, unicode):
+        value = unicode(value)
+    return _XML_SPECIAL.sub(
+        lambda match: _XML_ESCAPES.get(match.group(), u''),
+        value).encode('utf-8')
+
+
+def _xml_element(tag, text):
+    if not text:
+        return '<{} />'.format(tag)
+    return '<{0}>{1}</{0}>'.format(tag, text)
+
+
+def note_xml(dict):
+    """Takes a dictionary and creates a note element as UTF-8 xml.
+
+    Each list item gets its own item element, empty lists are left out.
+    Carriage returns are escaped so they aren't turned in to newlines when
+    the XML is read back. Written out directly as ElementTree's serializer
+    is several times slower than the JSON encoder.
+    """
+    parts = []
+    for field, value in dict.iteritems():
+        if isinstance(value, (list, tuple)):
+            if not value:
+                continue
+            text = ''.join(
+                _xml_element('item', _xml_escape(item))
+                for item in value)
+        else:
+            text = _xml_escape(value)
+        parts.append(_xml_element(field, text))
+    return _xml_element('note', ''.join(parts))
+
+
+def format_date(timestamp):
+    from datetime import datetime
+    date = datetime.fromtimestamp(timestamp)
+    return date.strftime('%b %d %Y %H:%M:%S')
+
+
+# fields of an exported note, in the order they are added to it as that
+# decides the order of the keys in the JSON, see export_note()
+EXPORT_FIELD_ORDER = (
+    'modifydate', 'createdate', 'tags', 'systemtags', 'content', 'key')
+
+# how to get each of them from a cached note
+EXPORT_FIELDS = {
+    'modifydate': lambda note: format_date(float(note.modifydate)),
+    'createdate': lambda note: format_date(float(note.createdate)),
+    'tags': lambda note: note.tags,
+    'systemtags': lambda note: note.systemtags,
+    'content': lambda note: note.content,
+    'key': lambda note: note.key,
+}
+
+
+def export_note(note, fields=None):
+    """Convert a cached note in to the exported format.
+
+    fields (default: None): Names of the EXPORT_FIELDS to export, all of them
+        if None. Fields left out aren't worked out at all, so leaving out
+        content saves decoding it
+    """
+    exported = {}
+    for field in EXPORT_FIELD_ORDER:
+        if fields is None or field in fields:
+            # update() rather than setting the item sizes the dict, and so
+            # orders its keys, the same as exports have always had
+            exported.update({field: EXPORT_FIELDS[field](note)})
+    return exported
+
+
+def _note_json(note):
+    return json.dumps(note)
+
+
+def _note_text(note):
+    return note['content'].encode('utf-8')
+
+
+class DocumentWriter(object):
+    """Writes serialized notes in to one file, between a header and footer.
+
+    Notes are written as they arrive so the document can be any size. The
+    whole document is rewritten every time.
+    """
+    @staticmethod
+    def begin(filename):
+        """Returns False, a document can't be updated in place."""
+        return False
+
+    def __init__(self, filename, header='', separator='', footer=''):
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.fh = open(filename, 'wb')
+        self.separator = separator
+        self.footer = footer
+        self._next = ''
+        self.fh.write(header)
+
+    def write(self, key, data):
+        self.fh.write(self._next)
+        self.fh.write(data)
+        self._next = self.separator
+
+    def close(self, complete=True, current=True):
+        self.fh.write(self.footer)
+        self.fh.close()
+
+
+class ExportManifest(object):
+    """Content hashes of the notes in a per note export directory.
+
+    Saved as .manifest.json in the directory along with whether the export
+    is complete, that is up to date with the cache apart from the notes the
+    sync being run changes.
+    """
+    def __init__(self, directory):
+        self.filename = os.path.join(directory, '.manifest.json')
+        self.complete = False
+        self.hashes = {}
+        if os.path.exists(self.filename):
+            with open(self.filename, 'rb') as fh:
+                data = json.load(fh)
+            self.complete = data['complete']
+            self.hashes = data['notes']
+
+    def save(self, complete):
+        self.complete = complete
+        _replace_file(self.filename, lambda fh: json.dump(
+            {'complete': complete, 'notes': self.hashes}, fh))
+
+
+class NoteFileWriter(object):
+    """Writes each serialized note to its own file, named after its key.
+
+    A manifest of content hashes means notes that haven't changed aren't
+    written again. After an export of every note the files of notes that
+    weren't in it are deleted. An export of only the changed notes removes
+    the files of the removed notes it is given instead.
+    """
+    @staticmethod
+    def begin(directory):
+        """Mark the export as out of date before the cache is changed.
+
+        @return True if it is complete, so exporting only the notes changed
+            from now on brings it up to date
+        """
+        if not os.path.isdir(directory):
+            return False
+        manifest = ExportManifest(directory)
+        complete = manifest.complete
+        manifest.save(False)
+        return complete
+
+    def __init__(self, directory, extension='.txt'):
+        self._log = logging.getLogger('sn.NoteFileWriter')
+        self.directory = directory
+        self.extension = extension
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.manifest = ExportManifest(directory)
+        self._seen = set()
+        self.written = 0
+
+    def _filename(self, key):
+        return os.path.join(self.directory, key + self.extension)
+
+    def write(self, key, data):
+        self._seen.add(key)
+        digest = hashlib.sha1(data).hexdigest()
+        filename = self._filename(key)
+        if (self.manifest.hashes.get(key) == digest and
+                os.path.exists(filename)):
+            return
+        with open(filename, 'wb') as fh:
+            fh.write(data)
+        self.manifest.hashes[key] = digest
+        self.written += 1
+
+    def remove(self, key):
+        self.manifest.hashes.pop(key, None)
+        try:
+            os.remove(self._filename(key))
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def close(self, complete=True, current=True):
+        """Save the manifest.
+
+        complete: True if every note was written, the files of any other
+            notes are removed
+        current: False if the export isn't up to date with the cache even
+            so, it is left marked out of date
+        """
+        if complete:
+            for key in set(self.manifest.hashes) - self._seen:
+                self.remove(key)
+        self._log.debug(
+            '%s notes written to %s', self.written, self.directory)
+        self.manifest.save(current)
+
+
+# serialize: Function from an export_note() dictionary to bytes
+# writer, arguments: Writer class and its arguments after the output path
+# output: Default output path
+ExportFormat = namedtuple('ExportFormat', 'serialize writer arguments output')
+EXPORT_FORMATS = {
+    'json': ExportFormat(
+        _note_json, DocumentWriter, ('[', ', ', ']'),
+        'simplenotebak.json.txt'),
+    'xml': ExportFormat(
+        note_xml, DocumentWriter,
+        ('<?xml version="1.0" encoding="UTF-8"?>\n<notes>', '', '</notes>\n'),
+        'simplenotebak.xml.txt'),
+    'text': ExportFormat(_note_text, NoteFileWriter, (), 'simplenotebak'),
+}
+# notes handed to a worker process at a time, and how many notes there have
+# to be before worker processes are started at all
+EXPORT_CHUNK = 250
+PARALLEL_EXPORT = 5000
+
+
+def _serialize(notes, formats, fields=None):
+    """Convert notes with export_note() then serialize them in every format.
+
+    @return list of (key, list of serialized note for each format)
+    """
+    serializers = [EXPORT_FORMATS[name].serialize for name in formats]
+    serialized = []
+    for note in notes:
+        exported = export_note(note, fields)
+        serialized.append(
+            (note.key, [serialize(exported) for serialize in serializers]))
+    return serialized
+
+
+def _serialized_chunks(notes, formats, processes, fields=None):
+    """Yields _serialize() results for chunks of notes, in order.
+
+    Once more than PARALLEL_EXPORT notes have been read the chunks are
+    serialized by a pool of worker processes. Only a few chunks are handed
+    out ahead of the one being written, so memory use stays bounded and
+    the cache is only read from this thread.
+    """
+    pool = None
+    pending = deque()
+    try:
+        for number, chunk in enumerate(_chunked(notes, EXPORT_CHUNK)):
+            if (pool is None and processes > 1 and
+                    number * EXPORT_CHUNK >= PARALLEL_EXPORT):
+                import multiprocessing
+                pool = multiprocessing.Pool(processes)
+            if pool is None:
+                yield _serialize(chunk, formats, fields)
+                continue
+            pending.append(
+                pool.apply_async(_serialize, (chunk, formats, fields)))
+            if len(pending) > processes * 2:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+def _chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def export(notes, outputs, processes=1, removed=None, fields=None,
+           partial=False):
+    """Export notes in several formats with one pass over them.
+
+    Each note is converted with export_note() once, serialized for every
+    format and handed to each format's writer, so the cache is only read
+    once however many formats are written.
+
+    outputs: List of (format name, output path)
+    processes (default: 1): Worker processes to serialize notes in when
+        there are more than PARALLEL_EXPORT of them
+    removed (default: None): None when notes is every note, otherwise notes
+        are only the changed notes and removed the keys of removed notes.
+        Only for outputs begin_export() said can be updated
+    fields (default: None): Fields to export, see export_note()
+    partial (default: False): notes are only some of the cached notes, or
+        not as they are cached, so the outputs are left marked out of date
+        and no files are removed
+
+    @return number of notes exported
+    """
+    formats = [name for name, _ in outputs]
+    writers = []
+    for name, path in outputs:
+        export_format = EXPORT_FORMATS[name]
+        writers.append(export_format.writer(path, *export_format.arguments))
+    count = 0
+    try:
+        for chunk in _serialized_chunks(notes, formats, processes, fields):
+            for key, serialized in chunk:
+                for writer, data in zip(writers, serialized):
+                    writer.write(key, data)
+            count += len(chunk)
+        for key in removed or ():
+            for writer in writers:
+                writer.remove(key)
+    finally:
+        for writer in writers:
+            writer.close(
+                complete=removed is None and not partial, current=not partial)
+    return count
+
+
+def begin_export(outputs):
+    """Mark exports out of date before a sync changes the cache.
+
+    @return True if every output can be brought up to date by exporting
+        only the notes the sync changes
+    """
+    updatable = True
+    for name, path in outputs:
+        if not EXPORT_FORMATS[name].writer.begin(path):
+            updatable = False
+    return updatable
+
+
+def export_changes(sncache, changes, outputs, processes=1):
+    """Export only the notes in changes, see begin_export()."""
+    notes = []
+    removed = list(changes.deleted)
+    for key in changes.changed:
+        note = sncache.get(key)
+        if note is None or note.deleted == 1:
+            removed.append(key)
+        else:
+            notes.append(note)
+    return export(notes, outputs, processes, removed)
+
+
+class SyncState(object):
+    """Where the last sync got to, so the next one only asks for changes.
+
+    Saved as sync.state in the data directory: the latest modifydate of any
+    note in the cache, the high-water mark a delta sync asks for notes
+    modified after, and when the last full sync was. Notes deleted for good
+    rather than moved to the trash don't show up in a delta, so a full sync
+    of the whole index is needed every so often to remove them.
+    """
+    # notes modified in the same second as the high-water mark could be in
+    # the next delta or not, asking for a little more makes sure they are
+    overlap = 1.0
+
+    def __init__(self, data_dir):
+        self.filename = os.path.join(data_dir, 'sync.state')
+        self.modifydate = None
+        self.full_sync = None
+        if os.path.exists(self.filename):
+            with open(self.filename, 'rb') as fh:
+                data = json.load(fh)
+            self.modifydate = data['modifydate']
+            self.full_sync = data['full_sync']
+
+    def since(self, full_every):
+        """since for the next sync, None if a full sync is due.
+
+        full_every: Seconds between full syncs, 0 for every time
+        """
+        if (self.modifydate is None or self.full_sync is None or
+                time.time() - self.full_sync >= full_every):
+            return None
+        return self.modifydate - self.overlap
+
+    def update(self, index, full):
+        """Move the high-water mark up to the latest note in index.
+
+        full: index is the whole index
+        """
+        for note in index:
+            modifydate = float(note.modifydate)
+            if self.modifydate is None or modifydate > self.modifydate:
+                self.modifydate = modifydate
+        if full:
+            self.full_sync = time.time()
+
+    def save(self):
+        _replace_file(self.filename, lambda fh: json.dump({
+            'modifydate': self.modifydate,
+            'full_sync': self.full_sync}, fh))
+
+
+class SyncCheckpoint(object):
+    """Progress of a sync, so an interrupted one carries on where it stopped.
+
+    Kept in sync.checkpoint in the data directory as one JSON record per line,
+    like the journal, so saving progress only appends to it. A record is
+    written when the sync starts with the since it gets the index with, for
+    each index page with the notes in it, the keys it found changed and the
+    mark of the next page, and each time notes downloaded since the last one
+    are saved in the cache. Loading it gives back the index so far, where to
+    continue it and the changed notes still to download. clear() removes it
+    once the sync is done.
+
+    A checkpoint older than max_age seconds is ignored, by then the index it
+    holds is too out of date to build on.
+
+    """
+    def __init__(self, data_dir, codec=None, max_age=24 * 60 * 60):
+        self._log = logging.getLogger('sn.SyncCheckpoint')
+        self.filename = os.path.join(data_dir, 'sync.checkpoint')
+        self.codec = codec
+        self.index = []
+        self.added = []
+        self.modified = []
+        self.saved = set()
+        self.mark = None
+        self.since = None
+        self.index_done = False
+        self.resumed = False
+        self._fh = None
+        if os.path.exists(self.filename):
+            if time.time() - os.path.getmtime(self.filename) > max_age:
+                self._log.info('ignoring old checkpoint %s', self.filename)
+                os.remove(self.filename)
+            else:
+                self._load()
+
+    def _load(self):
+        """Replay the records, stopping at a damaged one."""
+        with open(self.filename, 'rb') as fh:
+            for line in fh:
+                try:
+                    record = json.loads(decode_line(line))
+                except ValueError:
+                    self._log.warning('ignoring damaged checkpoint record')
+                    break
+                if 'saved' in record:
+                    self.saved.update(record['saved'])
+                    continue
+                if 'since' in record:
+                    self.since = record['since']
+                    continue
+                self.index.extend(
+                    NoteMeta.from_dict(note) for note in record['index'])
+                self.added.extend(record['added'])
+                self.modified.extend(record['modified'])
+                self.mark = record['mark']
+                self.index_done = self.mark is None
+        self.resumed = bool(self.index)
+        # anything after a damaged record is rewritten from what was read
+        self._fh = open(self.filename, 'wb')
+        if self.resumed:
+            self.start(self.since)
+            self._write({
+                'index': self.index,
+                'added': self.added,
+                'modified': self.modified,
+                'mark': self.mark})
+            self._write({'saved': sorted(self.saved)})
+
+    @property
+    def pending(self):
+        """Changed notes that aren't saved in the cache yet."""
+        return [key for key in self.added + self.modified
+                if key not in self.saved]
+
+    def _write(self, record):
+        if self._fh is None:
+            self._fh = open(self.filename, 'ab')
+        self._fh.write(encode_line(_dumps(record), self.codec) + '\n')
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+    def start(self, since):
+        """Record the since of a new sync, None for the whole index."""
+        self.since = since
+        self._write({'since': since})
+
+    def add_page(self, page, changes, mark):
+        """Record an index page, its ChangeSet and the next page's mark."""
+        self._write({
+            'index': page,
+            'added': changes.added,
+            'modified': changes.modified,
+            'mark': mark})
+
+    def add_saved(self, keys):
+        """Record notes that have been saved in the cache."""
+        self._write({'saved': keys})
+
+    def clear(self):
+        """Remove the checkpoint after a complete sync."""
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+def _fetch_note(sn, note_id):
+    """Fetch a single note, returning (note_id, note, error)."""
+    try:
+        return (note_id, sn.note(note_id), None)
+    except Exception as exc:
+        # anything raised here would never reach NoteFetcher, which would
+        # then wait forever for the result
+        return (note_id, None, exc)
+
+
+class NoteFetcher(object):
+    """Downloads notes in to the cache on a pool of worker threads.
+
+    More keys can be added while earlier ones are still downloading. The
+    cache is only changed from the thread calling add() and finish(), which
+    saves it every 50 notes and updates the progress bar. Notes that fail to
+    download are logged and left out of the cache so they are picked up as
+    changed again on the next run.
+
+    checkpoint (default: None): SyncCheckpoint told about notes once they
+        are saved in the cache
+
+    """
+    def __init__(self, sn, sncache, jobs=1, quiet=False, timer=None,
+                 checkpoint=None):
+        from multiprocessing.pool import ThreadPool
+        self._log = logging.getLogger('sn.NoteFetcher')
+        self.sn = sn
+        self.sncache = sncache
+        self.quiet = quiet
+        self.timer = timer or PhaseTimer()
+        self.checkpoint = checkpoint
+        self._unsaved = []
+        self.queued = set()
+        self.completed = 0
+        self.failed = []
+        self._done = Queue.Queue()
+        self._pool = ThreadPool(jobs)
+
+    def add(self, keys):
+        """Queue keys for download, skipping any that are already queued."""
+        for key in keys:
+            if key in self.queued:
+                continue
+            self.queued.add(key)
+            self._pool.apply_async(
+                _fetch_note, (self.sn, key), callback=self._done.put)
+        self._collect(block=False)
+
+    def _collect(self, block):
+        while self.completed < len(self.queued):
+            try:
+                result = self._done.get(block, 1)
+            except Queue.Empty:
+                if block:
+                    continue
+                return
+            self._store(*result)
+
+    def _store(self, note_id, note, error):
+        if error is None:
+            self.sncache.put(note_id, note)
+            self._unsaved.append(note_id)
+        else:
+            self._log.warning('unable to fetch note %s: %s', note_id, error)
+            self.failed.append(note_id)
+        self.completed += 1
+        if self.completed % 50 == 0:
+            self._log.debug('%s items added, save cache', self.completed)
+            with self.timer.phase('cache_save'):
+                self.sncache.save_cache()
+            if self.checkpoint is not None:
+                self.checkpoint.add_saved(self._unsaved)
+            self._unsaved = []
+        if not self.quiet:
+            pb.progress(50, math.floor(
+                float(self.completed) / len(self.queued) * 100.0))
+
+    def finish(self):
+        """Wait for every queued note.
+
+        @return list of note keys that could not be fetched
+        """
+        self._collect(block=True)
+        return self.failed
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def abort(self):
+        """Stop, keeping the notes already downloaded, instead of close().
+
+        Queued downloads are dropped rather than waited for, so a sync that
+        failed or was interrupted stops straight away. The notes that did
+        arrive are saved so they aren't downloaded again.
+        """
+        self._pool.terminate()
+        self._collect(block=False)
+        with self.timer.phase('cache_save'):
+            self.sncache.save_cache()
+        if self.checkpoint is not None:
+            self.checkpoint.add_saved(self._unsaved)
+        self._unsaved = []
+
+
+def _resume(checkpoint, fetcher, index, added, modified):
+    """Pick up the work of an interrupted sync from its checkpoint.
+
+    @return the mark of the next index page to get, False if the whole
+        index had already been read
+    """
+    log = logging.getLogger('sn.sync')
+    if checkpoint is None or not checkpoint.resumed:
+        return None
+    pending = checkpoint.pending
+    log.info(
+        'resuming sync with %s index entries, %s notes still to download',
+        len(checkpoint.index),
+        len(pending))
+    index.extend(checkpoint.index)
+    added.extend(checkpoint.added)
+    modified.extend(checkpoint.modified)
+    fetcher.add(pending)
+    if checkpoint.index_done:
+        return False
+    return checkpoint.mark
+
+
+def _remove_missing(sncache, index, timer):
+    """Remove the cached notes that aren't in the full index.
+
+    @return list of their keys
+    """
+    with timer.phase('diff'):
+        deleted = sncache.missing(set(note.key for note in index))
+    for key in deleted:
+        logging.getLogger('sn.sync').debug(
+            'note %s not in index, deleting', key)
+        sncache.remove(key)
+    return deleted
+
+
+def sync(sn, sncache, jobs=1, quiet=False, timer=None, checkpoint=None,
+         since=None):
+    """Walk the index and download changed notes at the same time.
+
+    Each index page is compared with the cache as soon as it arrives and its
+    changed notes are queued for download while later pages are fetched.
+    Notes missing from the index are removed once the last page is in.
+    Time spent is added to the index, diff, fetch and cache_save phases of
+    timer.
+
+    checkpoint (default: None): SyncCheckpoint to record progress in, if it
+        was loaded from an interrupted sync that one is continued instead
+        of starting over, without getting any index page or saved note again
+    since (default: None): Only walk the notes modified after this time, see
+        SyncState. Notes deleted for good can't be found that way so none
+        are removed. Taken from the checkpoint when resuming
+
+    @return tuple of (full index, ChangeSet, list of note keys that failed)
+    """
+    log = logging.getLogger('sn.sync')
+    timer = timer or PhaseTimer()
+    fetcher = NoteFetcher(sn, sncache, jobs, quiet, timer, checkpoint)
+    index = []
+    added = []
+    modified = []
+    mark = _resume(checkpoint, fetcher, index, added, modified)
+    if checkpoint is not None:
+        if checkpoint.resumed:
+            since = checkpoint.since
+        else:
+            checkpoint.start(since)
+    if since is not None:
+        log.info('getting notes modified since %s', since)
+    pages = (iter(()) if mark is False
+             else sn.index_pages(mark=mark, since=since))
+    try:
+        while True:
+            with timer.phase('index'):
+                page, mark = next(pages, (None, None))
+            if page is None:
+                break
+            index.extend(page)
+            with timer.phase('diff'):
+                changes = sncache.diff(page, partial=True)
+            added.extend(changes.added)
+            modified.extend(changes.modified)
+            if checkpoint is not None:
+                checkpoint.add_page(page, changes, mark)
+            fetcher.add(changes.changed)
+        log.info('index count: %s', len(index))
+        log.info('number of changes: %s', len(fetcher.queued))
+        deleted = []
+        if since is None:
+            deleted = _remove_missing(sncache, index, timer)
+        with timer.phase('fetch'):
+            failed = fetcher.finish()
+    except BaseException:
+        fetcher.abort()
+        raise
+    fetcher.close()
+    return (index, ChangeSet(added, modified, deleted), failed)
+
+
+def write_stats(filename, sn, timer, counts):
+    """Write run statistics to filename as JSON.
+
+    counts: Dictionary of note counts for the run
+    """
+    stats = {
+        'version': __version__,
+        'finished': time.time(),
+        'phases': timer.phases,
+        'notes': counts,
+        'api_count': sn.api_count,
+        'retries': sn.retry_count,
+        'throttled': sn.scheduler.throttle_count,
+        'connections': {
+            'opened': sn.connections_opened,
+            'reused': sn.connections_reused,
+        },
+        'endpoints': sn.stats.to_dict(),
+    }
+    directory = os.path.dirname(filename)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(filename, 'w') as fh:
+        json.dump(stats, fh, sort_keys=True)
+
+
+def read_first_config(files):
+    """parse the first file that exists then return config object
+
+    config.read() will parse all files in a list and merge them together with
+    the last file that exists taking precedence.  This will try each file in the
+    list and the first file that exists it will read in then stop.
+
+    @return config object
+    @raises ConfigError() if no files could be found
+    """
+    log = logging.getLogger('sn.read_first_config')
+    config = RawConfigParser()
+    for config_file in files:
+        log.debug('Attempting to read %s', config_file)
+        if config.read(config_file):
+            return config
+    raise ConfigError('could not read any config file')
+
+
+def account_sections(config):
+    """Sections with an account in them, [simplenote] and [simplenote:NAME]."""
+    return [section for section in config.sections()
+            if section == 'simplenote' or section.startswith('simplenote:')]
+
+
+def account_config(config, section):
+    """Copy of an account's section, and DEFAULT, as the simplenote section.
+
+    So the rest of the program reads any account like a single account
+    config file.
+    """
+    account = RawConfigParser()
+    account.add_section('simplenote')
+    for option, value in config.items(section):
+        account.set('simplenote', option, value)
+    return account
+
+
+def account_path(path, account):
+    """path for one of several accounts.
+
+    {account} in path is replaced by the account name, otherwise the file
+    goes in a directory named after the account where it would have been.
+    account None is for a single account and returns path as is.
+    """
+    if account is None:
+        return path
+    if '{account}' in path:
+        return path.replace('{account}', account)
+    return os.path.join(os.path.dirname(path), account, os.path.basename(path))
+
+
+_TIME_FORMATS = (
+    '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d')
+
+
+def parse_time(value):
+    """Seconds since the epoch from a number of them or a local date and time.
+
+    @raises ValueError() if value is neither
+    """
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for time_format in _TIME_FORMATS:
+        try:
+            return time.mktime(time.strptime(value, time_format))
+        except ValueError:
+            continue
+    raise ValueError('can not read time {}'.format(value))
+
+
+def config_get(config, option, default=None, convert=str):
+    """Returns an option from the simplenote section or default if unset.
+
+    convert is called on the value when the option is set.
+    """
+    if config.has_option('simplenote', option):
+        return convert(config.get('simplenote', option))
+    return default
+
+
+def get_jobs(options, config):
+    """Number of download workers, command line taking precedence.
+
+    @raises ConfigError() if the value is less than 1
+    """
+    jobs = options.jobs
+    if jobs is None and config.has_option('simplenote', 'jobs'):
+        jobs = config.getint('simplenote', 'jobs')
+    if jobs is None:
+        jobs = 1
+    if jobs < 1:
+        raise ConfigError('jobs must be at least 1')
+    return jobs
+
+
+def _check_command(parser, args):
+    """parser.error() unless args are a known command and its arguments."""
+    if not args:
+        return
+    if args[0] not in COMMANDS:
+        parser.error('unknown command {}'.format(args[0]))
+    if args[0] == 'history':
+        if len(args) != 2:
+            parser.error('history takes a note key')
+    elif args[0] != 'search' and len(args) > 1:
+        parser.error('{} takes no arguments'.format(args[0]))
+
+
+def _check_selection(parser, options, command):
+    """parser.error() for export filters or fields that can't be used."""
+    if options.fields is not None:
+        options.fields = options.fields.split(',')
+        for field in options.fields:
+            if field not in EXPORT_FIELDS:
+                parser.error('unknown field {}'.format(field))
+        if 'text' in options.format and 'content' not in options.fields:
+            parser.error('the text format needs the content field')
+    if ((_filtered(options) or options.fields is not None) and
+            command != 'export'):
+        parser.error('--tag, --systemtag, --after, --before and --fields '
+                     'only work with export')
+
+
+def _filtered(options):
+    return bool(options.tag or options.systemtag or
+                options.after is not None or options.before is not None)
+
+
+def export_filter(options):
+    """NoteFilter for the export options, None to export every note."""
+    if not _filtered(options):
+        return None
+    return NoteFilter(
+        options.tag, options.systemtag, options.after, options.before)
+
+
+def parse_options():
+    """Returns (options, args) from the command line."""
+    parser = OptionParser(
+        usage='%prog [options] [COMMAND]\n\n'
+        'Commands:\n'
+        '  sync          Update the cache from simplenote then export it '
+        '(default)\n'
+        '  export        Export the cache without going online\n'
+        '  search QUERY  Search the cache, see README.markdown\n'
+        '  stats         Show what is in the cache\n'
+        '  history KEY   List the stored versions of a note, or show it as '
+        'it was\n'
+        '                --at a time\n'
+        '  watch         Keep syncing every --interval seconds, see '
+        'README.markdown',
+        version='%prog v' + __version__)
+    parser.add_option(
+        '-c', '--config', default='',
+        help='Location of config file', metavar='FILE')
+    parser.add_option(
+        '-o', '--output',
+        help='Output file name, {format} is replaced by the format name '
+        '(default: simplenotebak.json.txt, simplenotebak.xml.txt or the '
+        'simplenotebak directory for text)', metavar='FILE')
+    parser.add_option(
+        '-f', '--format', default='json',
+        help='Comma separated export formats, json, xml or text for a file '
+        'per note, all written in one pass (default: %default)')
+    parser.add_option(
+        '-q', '--quiet', default=False,
+        help='Suppres output, mainly progress bar', action='store_true')
+    parser.add_option(
+        '-j', '--jobs', type='int', default=None,
+        help='Number of notes to download at once (default: 1)', metavar='N')
+    parser.add_option(
+        '--low-memory', default=False, action='store_true',
+        help='Keep only note metadata in memory, same as storage: lowmem')
+    parser.add_option(
+        '--stats', metavar='FILE',
+        help='Write request and timing statistics to FILE as JSON')
+    parser.add_option(
+        '-n', '--limit', type='int', default=20,
+        help='Most search results to show (default: %default)', metavar='N')
+    parser.add_option(
+        '--at', metavar='TIME',
+        help='Export, or show a note with history, as it was at TIME, '
+        'seconds since the epoch or a local YYYY-MM-DD[ HH:MM[:SS]]')
+    parser.add_option(
+        '-t', '--tag', action='append', default=[], metavar='TAG',
+        help='Export only notes tagged TAG, can be given more than once for '
+        'notes with every one of them')
+    parser.add_option(
+        '--systemtag', action='append', default=[], metavar='TAG',
+        help='Export only notes with system tag TAG, like pinned')
+    parser.add_option(
+        '--after', metavar='TIME',
+        help='Export only notes modified at or after TIME, see --at')
+    parser.add_option(
+        '--before', metavar='TIME',
+        help='Export only notes modified before TIME, see --at')
+    parser.add_option(
+        '--fields',
+        help='Comma separated fields to export, of ' +
+        ', '.join(sorted(EXPORT_FIELDS)) + ' (default: all of them)')
+    parser.add_option(
+        '-i', '--interval', type='float', metavar='SECONDS',
+        help='Seconds between syncs for watch (default: watch_interval in '
+        'the config file or 300)')
+    parser.add_option(
+        '--full', default=False, action='store_true',
+        help='Walk the whole index to find deleted notes, instead of only '
+        'the notes changed since the last sync')
+    parser.add_option(
+        '-a', '--account', action='append', metavar='NAME',
+        help='Only use the [simplenote:NAME] account, can be given more '
+        'than once')
+    parser.add_option(
+        '--parallel', type='int', default=4, metavar='N',
+        help='Most accounts to sync at once (default: %default)')
+    (options, args) = parser.parse_args()
+    _check_command(parser, args)
+    for name in ('at', 'after', 'before'):
+        if getattr(options, name) is not None:
+            try:
+                setattr(options, name, parse_time(getattr(options, name)))
+            except ValueError as exc:
+                parser.error(str(exc))
+    options.format = options.format.split(',')
+    for name in options.format:
+        if name not in EXPORT_FORMATS:
+            parser.error('unknown format {}'.format(name))
+    if (options.output is not None and len(options.format) > 1 and
+            '{format}' not in options.output):
+        parser.error('-o needs {format} in it to export several formats')
+    _check_selection(parser, options, args[0] if args else 'sync')
+    return (options, args)
+
+
+def export_outputs(options, account=None):
+    """Returns a list of (format name, output path) to export to.
+
+    account: Name of the account when there are several, see account_path()
+    """
+    if options.output is None:
+        outputs = [
+            (name, EXPORT_FORMATS[name].output) for name in options.format]
+    else:
+        outputs = [(name, options.output.replace('{format}', name))
+                   for name in options.format]
+    return [(name, account_path(path, account)) for name, path in outputs]
+
+
+def load_config(options):
+    """Returns a list of (account name, config, data_dir) for every account.
+
+    The account name is None when the config file only has a [simplenote]
+    section. Otherwise each account's config only has its own section, as
+    [simplenote], and [simplenote:NAME] accounts without a data_dir get a
+    directory named after them in the default one.
+
+    @raises ConfigError() for no accounts, an unknown --account or two
+        accounts sharing a data_dir
+    """
+    from util.appdirs import AppDirs
+    appdir = AppDirs('simplenote-cli')
+    script_path = os.path.abspath(os.path.dirname(sys.argv[0]))
+    config_files = [
+        options.config,
+        os.path.join(appdir.user_config_dir, 'config.ini'),
+        os.path.join(script_path, 'config.ini'),
+    ]
+    config = read_first_config(config_files)
+    sections = account_sections(config)
+    if not sections:
+        raise ConfigError('no [simplenote] section in config')
+    if sections == ['simplenote'] and not options.account:
+        data_dir = config_get(config, 'data_dir', appdir.user_data_dir)
+        return [(None, config, data_dir)]
+    names = dict((section.partition(':')[2] or 'simplenote', section)
+                 for section in sections)
+    for name in options.account or ():
+        if name not in names:
+            raise ConfigError('no account {} in config'.format(name))
+    accounts = []
+    for name in sorted(options.account or names):
+        account = account_config(config, names[name])
+        # [simplenote] keeps the cache it had before more accounts were added
+        default = appdir.user_data_dir
+        if names[name] != 'simplenote':
+            default = os.path.join(default, name)
+        data_dir = config_get(account, 'data_dir', default)
+        accounts.append((name, account, data_dir))
+    data_dirs = [os.path.abspath(entry[2]) for entry in accounts]
+    if len(set(data_dirs)) < len(data_dirs):
+        raise ConfigError('every account needs its own data_dir')
+    return accounts
+
+
+def get_storage(options, config):
+    """Cache storage type, --low-memory taking precedence."""
+    if options.low_memory:
+        return 'lowmem'
+    return config_get(config, 'storage', 'json')
+
+
+def open_history(config, data_dir):
+    """HistoryStore in data_dir, None unless history_days is set."""
+    if not config.has_option('simplenote', 'history_days'):
+        return None
+    from util.history import HistoryStore
+    return HistoryStore(
+        os.path.join(data_dir, 'history.sqlite'),
+        config_get(config, 'history_keyframe', 16, int))
+
+
+def record_history(history, config, sncache, changes):
+    """Store the versions a sync downloaded and drop ones past history_days."""
+    history.finish(sncache, changes.changed, changes.deleted)
+    days = config_get(config, 'history_days', 0, float)
+    if days > 0:
+        history.prune(time.time() - days * 24 * 60 * 60)
+    history.close()
+
+
+def search_index_file(data_dir):
+    return os.path.join(data_dir, 'search.sqlite')
+
+
+def load_cache(options, config, data_dir):
+    """Open the note cache in data_dir as configured."""
+    return open_cache(
+        data_dir, get_storage(options, config),
+        config_get(config, 'compression', 'none'))
+
+
+def full_sync_every(config):
+    """Seconds between syncs of the whole index, see SyncState."""
+    return config_get(config, 'full_sync_days', 7, float) * 24 * 60 * 60
+
+
+def export_processes(config):
+    import multiprocessing
+    return config_get(
+        config, 'export_processes', multiprocessing.cpu_count(), int)
+
+
+def command_search(options, config, data_dir, args, account=None):
+    """Search the local cache and print matching notes, best first.
+
+    The search index is built from the cache the first time, after that
+    each sync keeps it up to date.
+    """
+    from util.search import SearchIndex
+    query = ' '.join(args).decode('utf-8', 'replace')
+    index_file = search_index_file(data_dir)
+    exists = os.path.exists(index_file)
+    search = SearchIndex(index_file)
+    if not exists or not search.complete:
+        search.rebuild(load_cache(options, config, data_dir).notes())
+    for score, key, title in search.search(query, options.limit):
+        line = u'{:6.2f} {} {}\n'.format(score, key, title)
+        sys.stdout.write(line.encode('utf-8'))
+    search.close()
+
+
+def command_export(options, config, data_dir, args, account=None):
+    """Export the cached notes without syncing first.
+
+    With --at the notes are exported as they were then, from the history,
+    and like a filtered export the outputs are left marked out of date.
+    Filters from the command line are handed to the cache so notes that
+    don't match are never read in full.
+    """
+    where = export_filter(options)
+    if options.at is None:
+        notes = load_cache(options, config, data_dir).notes(where=where)
+    else:
+        history = _need_history(config, data_dir)
+        notes = (Note.from_dict(note) for note in history.snapshot(options.at)
+                 if note.get('deleted') != 1)
+        if where is not None:
+            notes = (note for note in notes if where.match(note))
+    export(notes, export_outputs(options, account), export_processes(config),
+           fields=options.fields,
+           partial=where is not None or options.at is not None)
+
+
+def _need_history(config, data_dir):
+    """open_history() for commands that can't do without it.
+
+    @raises ConfigError() if history isn't kept
+    """
+    history = open_history(config, data_dir)
+    if history is None:
+        raise ConfigError('no history is kept, set history_days to keep it')
+    return history
+
+
+def command_history(options, config, data_dir, args, account=None):
+    """List the stored versions of a note, or print it as it was --at."""
+    history = _need_history(config, data_dir)
+    if options.at is not None:
+        note = history.get(args[0], options.at)
+        if note is None:
+            sys.stderr.write('{} did not exist then\n'.format(args[0]))
+            return 1
+        sys.stdout.write(note['content'].encode('utf-8'))
+        return
+    for seq, syncnum, modifydate, keyframe, size in history.versions(args[0]):
+        sys.stdout.write('{:>5} {:>8} {:<20} {:<5} {:>8}\n'.format(
+            seq, 'deleted' if syncnum is None else syncnum,
+            format_date(modifydate), 'full' if keyframe else 'delta', size))
+
+
+def command_stats(options, config, data_dir, args, account=None):
+    """Print counts of the cached notes and the size of the data files."""
+    notes = trashed = size = 0
+    tags = set()
+    for note in load_cache(options, config, data_dir).notes(
+            include_deleted=True):
+        notes += 1
+        trashed += note.deleted == 1
+        size += len(note.content)
+        tags.update(note.tags)
+    lines = [
+        ('notes', notes - trashed),
+        ('trashed', trashed),
+        ('tags', len(tags)),
+        ('characters', size),
+    ]
+    for name in sorted(os.listdir(data_dir)):
+        path = os.path.join(data_dir, name)
+        if os.path.isfile(path):
+            lines.append((name, os.path.getsize(path)))
+    for name, value in lines:
+        sys.stdout.write('{:<24} {:>12}\n'.format(name, value))
+
+
+def begin_indexes(config, data_dir):
+    """Open the search index and history and mark them as being updated.
+
+    @return tuple of (SearchIndex, HistoryStore), None for ones not kept
+    """
+    search = None
+    if os.path.exists(search_index_file(data_dir)):
+        from util.search import SearchIndex
+        search = SearchIndex(search_index_file(data_dir))
+        search.begin()
+    history = open_history(config, data_dir)
+    if history is not None:
+        history.begin()
+    return (search, history)
+
+
+class AccountSync(object):
+    """A client and note cache for syncing one account, kept between syncs.
+
+    The first run() logs in and loads the cache. Later runs reuse both, the
+    client's open connections included, so command_watch() only pays for
+    what changed. With compact False the cache is only saved, which appends
+    to the journal in journal mode, and compacted by close() or a full sync.
+
+    account: Name of the account when there are several, its export and
+        stats files go where account_path() puts them
+    """
+    def __init__(self, options, config, data_dir, account=None):
+        from simplenote import Simplenote, DEFAULT_SERVER
+        self._log = logging.getLogger('sn')
+        self.options = options
+        self.config = config
+        self.data_dir = data_dir
+        self.account = account
+        self.jobs = get_jobs(options, config)
+        # one extra connection for fetching the index while notes download
+        self.sn = Simplenote(
+            config.get('simplenote', 'email'),
+            config.get('simplenote', 'password'),
+            pool_size=self.jobs + 1,
+            rate=config_get(config, 'rate', None, float),
+            retries=config_get(config, 'retries', 3, int),
+            server=config_get(config, 'server', DEFAULT_SERVER))
+        self.sncache = None
+        self.outputs = export_outputs(options, account)
+        # whether the outputs hold every note as of the last run
+        self.exported = False
+
+    def login(self, timer):
+        with timer.phase('login'):
+            self.sn.login()
+
+    def run(self, compact=True):
+        """Sync once and export the changes.
+
+        @return dictionary of note counts for the run and api calls made
+        """
+        timer = PhaseTimer()
+        if self.sncache is None:
+            self.login(timer)
+            with timer.phase('cache_load'):
+                self.sncache = load_cache(
+                    self.options, self.config, self.data_dir)
+        updatable = begin_export(self.outputs)
+        search, history = begin_indexes(self.config, self.data_dir)
+        checkpoint = SyncCheckpoint(self.data_dir, self.sncache.codec)
+        state = SyncState(self.data_dir)
+        since = None
+        if not self.options.full:
+            since = state.since(full_sync_every(self.config))
+        self._log.debug('loading index')
+        index, changes, failed = sync(
+            self.sn, self.sncache, self.jobs, self.options.quiet, timer,
+            checkpoint, since)
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug('saving entire index file as fullindex.json.txt')
+            with open('fullindex.json.txt', 'w') as fh:
+                fh.write(_dumps(index))
+        if failed:
+            self._log.warning('%s notes could not be fetched', len(failed))
+        with timer.phase('cache_save'):
+            if compact or checkpoint.since is None:
+                self.sncache.compact()
+            else:
+                self.sncache.save_cache()
+        checkpoint.clear()
+        if not failed:
+            # failed notes are found again by the next delta as long as the
+            # high-water mark doesn't move past them
+            state.update(index, full=checkpoint.since is None)
+            state.save()
+        self._finish_indexes(timer, search, history, changes)
+        self._log_requests()
+        with timer.phase('export'):
+            self._export(changes, updatable)
+        counts = {
+            'index': len(index),
+            'changed': len(changes.changed),
+            'deleted': len(changes.deleted),
+            'failed': len(failed),
+        }
+        if self.options.stats:
+            write_stats(
+                account_path(self.options.stats, self.account), self.sn, timer,
+                counts)
+        return dict(counts, api_count=self.sn.api_count)
+
+    def _finish_indexes(self, timer, search, history, changes):
+        if search is not None:
+            with timer.phase('search_index'):
+                search.finish(self.sncache, changes.changed, changes.deleted)
+            search.close()
+        if history is not None:
+            with timer.phase('history'):
+                record_history(history, self.config, self.sncache, changes)
+
+    def _log_requests(self):
+        sn = self.sn
+        self._log.info('Number of api calls: {}'.format(sn.api_count))
+        self._log.info(
+            'Connections opened: %s, reused: %s',
+            sn.connections_opened,
+            sn.connections_reused)
+        self._log.info('Requests retried: %s', sn.retry_count)
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug('saving all notes as fullnotes.json.txt')
+            with open('fullnotes.json.txt', 'w') as fh:
+                fh.write(_dumps(dict(
+                    (note.key, note)
+                    for note in self.sncache.notes(include_deleted=True))))
+
+    def _export(self, changes, updatable):
+        """Bring the outputs up to date with the cache.
+
+        A document format has to be written again whole when anything
+        changed, but not when nothing did since the last run exported it.
+        """
+        processes = export_processes(self.config)
+        if updatable:
+            export_changes(self.sncache, changes, self.outputs, processes)
+        elif self.exported and not (changes.changed or changes.deleted):
+            self._log.debug('nothing changed, export left as it is')
+        else:
+            export(self.sncache.notes(), self.outputs, processes)
+        self.exported = True
+
+    def close(self):
+        """Compact the cache and close the client's connections."""
+        if self.sncache is not None:
+            self.sncache.compact()
+        self.sn.pool.close()
+
+
+def sync_account(options, config, data_dir, account=None):
+    """Update the cache from simplenote and export every note.
+
+    account: Name of the account when there are several, see AccountSync
+    @return dictionary of note counts for the run and api calls made
+    """
+    return AccountSync(options, config, data_dir, account).run()
+
+
+def command_sync(options, config, data_dir, args, account=None):
+    """Update the cache from simplenote and export every note."""
+    sync_account(options, config, data_dir, account)
+
+
+def command_watch(options, config, data_dir, args, account=None):
+    """Sync every watch_interval seconds until interrupted or terminated.
+
+    The client stays logged in with its connections open and the cache
+    stays loaded between syncs, so each one only costs the requests for
+    what changed. Each wait is made up to watch_jitter of the interval
+    longer or shorter so many clients started together spread out. A sync
+    that fails is logged and tried again after the next wait, logging in
+    again first in case the token expired.
+    """
+    import random
+    import signal
+    log = logging.getLogger('sn.watch')
+    interval = options.interval
+    if interval is None:
+        interval = config_get(config, 'watch_interval', 300, float)
+    jitter = config_get(config, 'watch_jitter', 0.1, float)
+    # stop cleanly, compacting the cache, when terminated as a service
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    syncer = AccountSync(options, config, data_dir, account)
+    relogin = False
+    api_count = 0
+    try:
+        while True:
+            start = time.time()
+            try:
+                if relogin and syncer.sncache is not None:
+                    syncer.login(PhaseTimer())
+                counts = syncer.run(compact=False)
+                relogin = False
+                # the client's counts are since watch started
+                log.info(
+                    'synced %s changed and %s deleted notes with %s api calls '
+                    'in %.1f seconds', counts['changed'], counts['deleted'],
+                    counts['api_count'] - api_count, time.time() - start)
+                api_count = counts['api_count']
+            except Exception:
+                log.exception('sync failed, trying again next time')
+                relogin = True
+            wait = interval * random.uniform(1 - jitter, 1 + jitter)
+            time.sleep(max(0, wait - (time.time() - start)))
+    except (KeyboardInterrupt, SystemExit):
+        log.info('stopping')
+    finally:
+        syncer.close()
+
+
+def _sync_worker(job):
+    """Sync one account in a worker process.
+
+    @return tuple of (account, counts or None, seconds, error message or None)
+    """
+    options, account, config, data_dir = job
+    # pool workers are daemonic and can't start an export pool of their own
+    config.set('simplenote', 'export_processes', '1')
+    start = time.time()
+    try:
+        counts = sync_account(options, config, data_dir, account)
+    except Exception as exc:
+        logging.getLogger('sn').exception('account %s failed', account)
+        return (account, None, time.time() - start, str(exc) or repr(exc))
+    return (account, counts, time.time() - start, None)
+
+
+def sync_accounts(options, accounts):
+    """Sync several accounts, up to --parallel of them at once.
+
+    Each account runs in its own process with its own connections, cache
+    and search index, so a slow or failing account doesn't hold up the
+    others. Progress bars are turned off as they would write over each other.
+    A summary of every account is printed unless --quiet.
+
+    accounts: List of (account name, config, data_dir)
+    @return 1 if any account failed, otherwise 0
+    """
+    import multiprocessing
+    if options.parallel < 1:
+        raise ConfigError('parallel must be at least 1')
+    quiet = options.quiet
+    options.quiet = True
+    jobs = [(options, name, config, data_dir)
+            for name, config, data_dir in accounts]
+    start = time.time()
+    # a fresh process per account so no connection or cache is shared
+    pool = multiprocessing.Pool(
+        min(options.parallel, len(jobs)), maxtasksperchild=1)
+    try:
+        results = sorted(pool.imap_unordered(_sync_worker, jobs))
+    finally:
+        pool.close()
+        pool.join()
+    if not quiet:
+        write_summary(results, time.time() - start)
+    return int(any(error is not None for _, _, _, error in results))
+
+
+def write_summary(results, seconds):
+    """Print a table of the results from sync_accounts()."""
+    columns = ('index', 'changed', 'deleted', 'failed', 'api_count')
+    sys.stdout.write('{:<16} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8}\n'.format(
+        'account', 'notes', 'changed', 'deleted', 'failed', 'api', 'seconds'))
+    for account, counts, elapsed, error in results:
+        if error is not None:
+            sys.stdout.write('{:<16} error: {}\n'.format(account, error))
+            continue
+        sys.stdout.write('{:<16} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8.1f}\n'.format(
+            account, *([counts[column] for column in columns] + [elapsed])))
+    sys.stdout.write('{} accounts in {:.1f} seconds\n'.format(
+        len(results), seconds))
+
+
+COMMANDS = {
+    'sync': command_sync,
+    'export': command_export,
+    'search': command_search,
+    'history': command_history,
+    'watch': command_watch,
+    'stats': command_stats,
+}
+
+
+def main():
+    """The main function."""
+    (options, args) = parse_options()
+    accounts = load_config(options)
+    command = args[0] if args else 'sync'
+    if command == 'sync' and accounts[0][0] is not None:
+        return sync_accounts(options, accounts)
+    if len(accounts) > 1:
+        raise ConfigError(
+            '{} works on one account, choose it with --account'.format(command))
+    (account, config, data_dir) = accounts[0]
+    return COMMANDS[command](options, config, data_dir, args[1:], account)
@@ -0,0 +1,95 @@
+"""
+Compression for cached notes.
+
+Compressed data starts with the codec's magic bytes so it can always be read
+back, whatever codec is configured now and even if it was written without
+compression. That lets the setting be changed at any time: old data is
+still read and is rewritten with the new codec as notes change.
+
+Codecs:
+  zlib   zlib at the default level
+  fast   lz4 when the lz4 package is installed, otherwise zlib at level 1
+  none   no compression
+
+"""
+import base64
+import zlib
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+# lines written by encode_line() that hold compressed data start with this,
+# a JSON record always starts with {
+_LINE_MARK = '~'
+
+
+class Codec(object):
+    """A named compress/decompress pair and the magic its output starts with."""
+    def __init__(self, name, magic, compress, decompress):
+        self.name = name
+        self.magic = magic
+        self.compress = compress
+        self.decompress = decompress
+
+
+_ZLIB = Codec('zlib', '\x78', zlib.compress, zlib.decompress)
+_CODECS = [_ZLIB]
+if lz4 is not None:
+    _CODECS.append(Codec(
+        'lz4', '\x04\x22\x4d\x18', lz4.frame.compress, lz4.frame.decompress))
+
+
+def get_codec(name):
+    """Returns the Codec called name, None for none.
+
+    @raises ValueError() for an unknown codec
+    """
+    if name == 'none':
+        return None
+    if name == 'zlib':
+        return _ZLIB
+    if name == 'fast':
+        if lz4 is not None:
+            return _CODECS[-1]
+        return Codec(
+            'zlib', _ZLIB.magic, lambda data: zlib.compress(data, 1),
+            zlib.decompress)
+    raise ValueError('unknown compression {}'.format(name))
+
+
+def compress(data, codec):
+    """Compress the byte string data with codec, returned as is for None."""
+    if codec is None:
+        return data
+    return codec.compress(data)
+
+
+def decompress(data):
+    """Returns data decompressed, or unchanged if it isn't compressed."""
+    for codec in _CODECS:
+        if data.startswith(codec.magic):
+            return codec.decompress(data)
+    return data
+
+
+def encode_line(data, codec):
+    """Compress data to a single line of text for line based files."""
+    if codec is None:
+        return data
+    return _LINE_MARK + base64.b64encode(codec.compress(data))
+
+
+def decode_line(line):
+    """Reverse encode_line(), line may still have its newline.
+
+    @raises ValueError() if the line is damaged
+    """
+    if not line.startswith(_LINE_MARK):
+        return line
+    try:
+        return decompress(base64.b64decode(line[1:]))
+    except Exception as exc:
+        raise ValueError('damaged compressed line: {}'.format(exc))
@@ -0,0 +1,346 @@
+"""
+Earlier versions of notes.
+
+Every version of a note the sync downloads is kept in a SQLite database,
+numbered per note in the order they arrive. Most versions are stored as a
+zlib compressed delta against the version before: the runs of words of content
+kept from it and the text added, along with the metadata that changed. Words
+rather than lines as a note is often a few long paragraphs. Every
+keyframe_every versions, and the first time a note is seen, the whole note is
+stored instead, so getting a version back only means applying the deltas
+since the last keyframe. A note deleted for good gets a version without data
+marking when it went.
+
+Versions are looked up by time using the note's modifydate, or the time it
+was deleted, so the whole corpus can be put back the way it was at any
+time. prune() drops versions older than that no longer needed.
+
+Notes are anything with key, syncnum and to_dict(), like simplenote.Note.
+Versions come back as dictionaries in the same form as the api.
+
+"""
+import difflib
+import json
+import logging
+import re
+import time
+import zlib
+
+from util.mirror import CacheMirror
+
+
+# words with the white space after them, joined back they give the content
+_WORD = re.compile(r'\s+|\S+\s*', re.UNICODE)
+
+
+def _words(note):
+    return _WORD.findall(note.get('content') or u'')
+
+
+def _matching_ops(old, new):
+    """Operations building word list new from old, see make_delta().
+
+    Most edits are in one place, so the words they have in common at the
+    start and end are matched before difflib looks at the rest.
+    """
+    size = min(len(old), len(new))
+    start = 0
+    while start < size and old[start] == new[start]:
+        start += 1
+    end = 0
+    while end < size - start and old[-1 - end] == new[-1 - end]:
+        end += 1
+    ops = [[0, start]] if start else []
+    matcher = difflib.SequenceMatcher(
+        None, old[start:len(old) - end], new[start:len(new) - end], False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([start + i1, start + i2])
+        elif j1 < j2:
+            ops.append(u''.join(new[start + j1:start + j2]))
+    if end:
+        ops.append([len(old) - end, len(old)])
+    return ops
+
+
+def make_delta(old, new):
+    """Delta that turns note dictionary old in to new.
+
+    @return dictionary of the metadata fields that changed, ones that were
+        removed and the operations to build the content from old's words:
+        [start, end] copies old words, a string is new text
+    """
+    meta = dict((field, value) for field, value in new.iteritems()
+                if field != 'content' and old.get(field) != value)
+    dropped = [field for field in old if field not in new]
+    return {
+        'meta': meta,
+        'dropped': dropped,
+        'ops': _matching_ops(_words(old), _words(new)),
+    }
+
+
+def _apply(note, words, delta):
+    """Apply delta to note and its content split in to words.
+
+    @return tuple of (note without content, words of the new content)
+    """
+    new_words = []
+    for op in delta['ops']:
+        if isinstance(op, list):
+            new_words.extend(words[op[0]:op[1]])
+        else:
+            new_words.extend(_WORD.findall(op))
+    note = dict(note)
+    note.update(delta['meta'])
+    for field in delta['dropped']:
+        del note[field]
+    return (note, new_words)
+
+
+def apply_delta(old, delta):
+    """Note dictionary from old and a delta made by make_delta()."""
+    note, words = _apply(old, _words(old), delta)
+    note['content'] = u''.join(words)
+    return note
+
+
+def _pack(data):
+    return buffer(zlib.compress(json.dumps(data)))
+
+
+def _unpack(data):
+    return json.loads(zlib.decompress(str(data)))
+
+
+class HistoryStore(CacheMirror):
+    """Every version of every note, stored as deltas between keyframes.
+
+    Like every util.mirror.CacheMirror it records whether it is complete,
+    versions missed by an interrupted sync are picked up from the cache the
+    next time.
+
+    keyframe_every (default: 16): Store the whole note after this many
+        deltas
+
+    """
+    def __init__(self, filename, keyframe_every=16):
+        self._log = logging.getLogger('util.history.HistoryStore')
+        super(HistoryStore, self).__init__(filename)
+        self.keyframe_every = keyframe_every
+        # versions refer to notes by a number rather than the key so each
+        # one costs little more than its data
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS notes (
+                id INTEGER PRIMARY KEY,
+                key TEXT UNIQUE NOT NULL);
+            CREATE TABLE IF NOT EXISTS versions (
+                note INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                syncnum INTEGER,
+                modifydate REAL NOT NULL,
+                keyframe INTEGER NOT NULL,
+                data BLOB,
+                PRIMARY KEY (note, seq)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS versions_modifydate
+                ON versions (modifydate);
+        ''')
+
+    def _id(self, key, create=False):
+        """Number of the note with key, None if it has no versions."""
+        row = self.db.execute(
+            'SELECT id FROM notes WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            return row[0]
+        if create:
+            return self.db.execute(
+                'INSERT INTO notes (key) VALUES (?)', (key,)).lastrowid
+        return None
+
+    def _latest(self, note):
+        """Returns (seq, syncnum, seq of its keyframe) or None."""
+        return self.db.execute(
+            'SELECT seq, syncnum, (SELECT MAX(seq) FROM versions '
+            'WHERE note = ? AND keyframe = 1) '
+            'FROM versions WHERE note = ? ORDER BY seq DESC LIMIT 1',
+            (note, note)).fetchone()
+
+    def _build(self, note, seq):
+        """The note as it was at version seq, None if deleted by then."""
+        rows = self.db.execute(
+            'SELECT keyframe, data FROM versions WHERE note = ? AND seq <= ? '
+            'AND seq >= (SELECT MAX(seq) FROM versions WHERE note = ? '
+            'AND seq <= ? AND keyframe = 1) ORDER BY seq',
+            (note, seq, note, seq))
+        return self._replay(rows)
+
+    @staticmethod
+    def _replay(rows):
+        """Note from a keyframe and the deltas after it.
+
+        The content is kept split in to words until the last delta is
+        applied, rather than joined and split again for each of them.
+        """
+        note = None
+        words = None
+        for keyframe, data in rows:
+            if data is None:
+                note = None
+            elif keyframe:
+                note = _unpack(data)
+                words = _words(note)
+            else:
+                note, words = _apply(note, words, _unpack(data))
+        if note is not None:
+            note['content'] = u''.join(words)
+        return note
+
+    def add(self, note):
+        """Store note if it is a version not stored yet.
+
+        @return True if it was stored
+        """
+        data = note.to_dict()
+        number = self._id(note.key, create=True)
+        latest = self._latest(number)
+        if latest is None:
+            seq = 0
+            keyframe = True
+        else:
+            if latest[1] == note.syncnum:
+                return False
+            seq = latest[0] + 1
+            keyframe = (latest[1] is None or
+                        seq - latest[2] >= self.keyframe_every)
+        if keyframe:
+            packed = _pack(data)
+        else:
+            packed = _pack(make_delta(self._build(number, latest[0]), data))
+        self.db.execute(
+            'INSERT INTO versions VALUES (?, ?, ?, ?, ?, ?)',
+            (number, seq, note.syncnum, float(note.modifydate or 0),
+             int(keyframe), packed))
+        return True
+
+    def remove(self, key, when=None):
+        """Record that a note was deleted for good at when, default now."""
+        number = self._id(key)
+        latest = None if number is None else self._latest(number)
+        if latest is None or latest[1] is None:
+            return
+        self.db.execute(
+            'INSERT INTO versions VALUES (?, ?, NULL, ?, 1, NULL)',
+            (number, latest[0] + 1, time.time() if when is None else when))
+
+    def finish(self, cache, changed, deleted):
+        """Store the notes changed since begin().
+
+        If the history wasn't complete when begin() was called every note
+        in the cache is checked instead, only new versions being stored.
+
+        cache: Note cache to read changed notes from
+        changed: Keys of added and modified notes
+        deleted: Keys of notes deleted for good
+        """
+        if self._was_complete:
+            notes = (cache.get(key) for key in changed)
+        else:
+            self._log.info('adding every cached note to %s', self.filename)
+            notes = cache.notes(include_deleted=True)
+        added = sum(self.add(note) for note in notes if note is not None)
+        for key in deleted:
+            self.remove(key)
+        self._log.debug('stored %s versions', added)
+        self._set_complete(True)
+        self.db.commit()
+
+    def versions(self, key):
+        """Versions of a note, oldest first.
+
+        @return list of (seq, syncnum, modifydate, keyframe, bytes stored),
+            syncnum is None for a deletion
+        """
+        return self.db.execute(
+            'SELECT seq, syncnum, modifydate, keyframe, '
+            'COALESCE(LENGTH(data), 0) FROM versions '
+            'WHERE note = (SELECT id FROM notes WHERE key = ?) '
+            'ORDER BY seq', (key,)).fetchall()
+
+    def get(self, key, at=None):
+        """The note as it was at time at, latest if None.
+
+        @return note dictionary, None if it didn't exist then
+        """
+        number = self._id(key)
+        if number is None:
+            return None
+        sql = 'SELECT MAX(seq) FROM versions WHERE note = ?'
+        args = (number,)
+        if at is not None:
+            sql += ' AND modifydate <= ?'
+            args += (at,)
+        seq = self.db.execute(sql, args).fetchone()[0]
+        if seq is None:
+            return None
+        return self._build(number, seq)
+
+    def snapshot(self, at):
+        """Every note as it was at time at, in key order.
+
+        Only the versions since each note's last keyframe before at are read.
+
+        @return iterator of note dictionaries
+        """
+        rows = self.db.execute('''
+            SELECT n.key, v.keyframe, v.data FROM versions v
+            JOIN notes n ON n.id = v.note
+            JOIN (SELECT note, MAX(seq) AS seq FROM versions
+                  WHERE modifydate <= ? GROUP BY note) t ON v.note = t.note
+            WHERE v.seq <= t.seq AND v.seq >= (
+                SELECT MAX(seq) FROM versions k
+                WHERE k.note = v.note AND k.seq <= t.seq AND k.keyframe = 1)
+            ORDER BY n.key, v.seq''', (at,))
+        key = None
+        group = []
+        for row in rows:
+            if row[0] != key and group:
+                note = self._replay(group)
+                if note is not None:
+                    yield note
+                group = []
+            key = row[0]
+            group.append(row[1:])
+        note = self._replay(group)
+        if note is not None:
+            yield note
+
+    def prune(self, before):
+        """Drop versions no longer needed to get back to any time from before.
+
+        The version each note was at at time before is kept, as a keyframe,
+        and older ones removed. Notes deleted for good by then are removed
+        entirely.
+
+        @return number of versions removed
+        """
+        # only notes with more than one version from before then have any
+        # to remove, the rest aren't rebuilt at all
+        rows = self.db.execute(
+            'SELECT note, MAX(seq) FROM versions WHERE modifydate <= ? '
+            'GROUP BY note HAVING MAX(seq) > MIN(seq)', (before,)).fetchall()
+        removed = 0
+        for number, seq in rows:
+            note = self._build(number, seq)
+            if note is not None:
+                self.db.execute(
+                    'UPDATE versions SET keyframe = 1, data = ? '
+                    'WHERE note = ? AND seq = ?', (_pack(note), number, seq))
+                seq -= 1
+            removed += self.db.execute(
+                'DELETE FROM versions WHERE note = ? AND seq <= ?',
+                (number, seq)).rowcount
+        self.db.execute(
+            'DELETE FROM notes WHERE id NOT IN (SELECT note FROM versions)')
+        self.db.commit()
+        self._log.debug('pruned %s versions', removed)
+        return removed
@@ -0,0 +1,48 @@
+"""
+SQLite databases kept up to date with the note cache by every sync.
+
+A mirror records whether it is complete, that is whether it holds every
+change made to the cache. begin() clears the flag before a sync changes the
+cache and the subclass's finish() sets it again once the changes are in, so
+a mirror left behind by an interrupted sync is caught up from the whole
+cache the next time.
+
+"""
+import sqlite3
+
+
+class CacheMirror(object):
+    """Base class of util.search.SearchIndex and util.history.HistoryStore.
+
+    Opens filename as self.db with a meta table for the complete flag,
+    subclasses create their own tables after calling __init__().
+
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS meta (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL)''')
+        self._was_complete = self.complete
+
+    @property
+    def complete(self):
+        row = self.db.execute(
+            "SELECT value FROM meta WHERE name = 'complete'").fetchone()
+        return row is not None and row[0] == '1'
+
+    def _set_complete(self, complete):
+        self.db.execute(
+            "INSERT OR REPLACE INTO meta VALUES ('complete', ?)",
+            ('1' if complete else '0',))
+
+    def begin(self):
+        """Mark it incomplete while the cache is being changed."""
+        self._was_complete = self.complete
+        self._set_complete(False)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
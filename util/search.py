@@ -0,0 +1,280 @@
+"""
+Full text search over notes.
+
+An inverted index kept in a SQLite database. For every word it stores the
+notes the word appears in, how often and at which positions, so a query
+only reads the posting lists of the words it asks for instead of every
+note. Results are ranked with BM25.
+
+Query syntax:
+  milk eggs        notes with both words
+  "buy milk"       notes with the words next to each other
+  tag:shopping     notes tagged shopping
+
+Notes are anything with key, deleted, tags and content attributes, like
+simplenote.Note.
+
+"""
+import heapq
+import math
+import re
+import logging
+
+from util.mirror import CacheMirror
+
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+_QUERY = re.compile(r'"([^"]*)"|(\S+)', re.UNICODE)
+# stay below sqlite's limit on the number of ? in a query
+_CHUNK = 500
+
+
+def tokenize(text):
+    """Lowercase words in text, in order."""
+    return _TOKEN.findall(text.lower())
+
+
+def parse_query(query):
+    """Split a query in to (terms, phrases, tags).
+
+    phrases is a list of word lists. A quoted single word is a plain term.
+    """
+    terms = []
+    phrases = []
+    tags = []
+    for phrase, word in _QUERY.findall(query):
+        if phrase:
+            words = tokenize(phrase)
+            if len(words) > 1:
+                phrases.append(words)
+            else:
+                terms.extend(words)
+        elif word.lower().startswith('tag:'):
+            tags.append(word[4:].lower())
+        else:
+            terms.extend(tokenize(word))
+    return (terms, phrases, tags)
+
+
+def _chunks(items):
+    items = list(items)
+    for start in range(0, len(items), _CHUNK):
+        yield items[start:start + _CHUNK]
+
+
+def _is_phrase(positions, words):
+    """True if words appear one after the other.
+
+    positions: Dictionary of word to set of positions in one note
+    """
+    for start in positions[words[0]]:
+        if all(start + offset in positions[word]
+               for offset, word in enumerate(words[1:], 1)):
+            return True
+    return False
+
+
+class SearchIndex(CacheMirror):
+    """Inverted index of note content and tags stored in SQLite.
+
+    Like every util.mirror.CacheMirror it records whether it is complete,
+    an index left behind by an interrupted sync is rebuilt.
+
+    """
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, filename):
+        self._log = logging.getLogger('util.search.SearchIndex')
+        super(SearchIndex, self).__init__(filename)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS docs (
+                id INTEGER PRIMARY KEY,
+                key TEXT UNIQUE NOT NULL,
+                length INTEGER NOT NULL,
+                title TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                doc INTEGER NOT NULL,
+                tf INTEGER NOT NULL,
+                positions TEXT NOT NULL,
+                PRIMARY KEY (term, doc));
+            CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc);
+            CREATE TABLE IF NOT EXISTS tags (
+                tag TEXT NOT NULL,
+                doc INTEGER NOT NULL,
+                PRIMARY KEY (tag, doc));
+            CREATE INDEX IF NOT EXISTS tags_doc ON tags (doc);
+        ''')
+
+    def _remove(self, key):
+        row = self.db.execute(
+            'SELECT id FROM docs WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return
+        for table in ('postings', 'tags'):
+            self.db.execute(
+                'DELETE FROM {} WHERE doc = ?'.format(table), (row[0],))
+        self.db.execute('DELETE FROM docs WHERE id = ?', (row[0],))
+
+    def _add(self, note):
+        self._remove(note.key)
+        if note.deleted == 1:
+            return
+        content = note.content
+        words = tokenize(content)
+        title = content.strip().split('\n', 1)[0][:200]
+        doc = self.db.execute(
+            'INSERT INTO docs (key, length, title) VALUES (?, ?, ?)',
+            (note.key, len(words), title)).lastrowid
+        positions = {}
+        for position, word in enumerate(words):
+            positions.setdefault(word, []).append(position)
+        self.db.executemany(
+            'INSERT INTO postings VALUES (?, ?, ?, ?)',
+            ((word, doc, len(where), ','.join(str(p) for p in where))
+             for word, where in positions.iteritems()))
+        self.db.executemany(
+            'INSERT OR IGNORE INTO tags VALUES (?, ?)',
+            ((tag.lower(), doc) for tag in note.tags))
+
+    def rebuild(self, notes):
+        """Replace the whole index with notes."""
+        self._log.info('building search index %s', self.filename)
+        for table in ('postings', 'tags', 'docs'):
+            self.db.execute('DELETE FROM {}'.format(table))
+        for note in notes:
+            self._add(note)
+        self._set_complete(True)
+        self.db.commit()
+
+    def finish(self, cache, changed, deleted):
+        """Index the notes changed since begin().
+
+        If the index wasn't complete when begin() was called every note in
+        the cache is indexed instead.
+
+        cache: Note cache to read changed notes from
+        changed: Keys of added and modified notes
+        deleted: Keys of removed notes
+        """
+        if not self._was_complete:
+            return self.rebuild(cache.notes())
+        self._log.debug(
+            'indexing %s changed and %s deleted notes',
+            len(changed),
+            len(deleted))
+        for key in changed:
+            note = cache.get(key)
+            if note is not None:
+                self._add(note)
+        for key in deleted:
+            self._remove(key)
+        self._set_complete(True)
+        self.db.commit()
+
+    def _select(self, sql, args, column, docs, scan=False):
+        """Rows of sql where column is one of docs.
+
+        sql has a {} where the condition on column goes. docs are looked up in
+        chunks, or with scan every row is read and filtered, which is quicker
+        when docs covers a large part of the table.
+        """
+        if scan:
+            return (row for row in self.db.execute(sql.format('1'), args)
+                    if row[0] in docs)
+        return (row for chunk in _chunks(docs)
+                for row in self.db.execute(sql.format('{} IN ({})'.format(
+                    column, ','.join('?' * len(chunk)))), args + chunk))
+
+    def _postings(self, term, docs=None):
+        """Returns {doc: tf} for term, only for docs if given."""
+        if docs is None:
+            return dict(self.db.execute(
+                'SELECT doc, tf FROM postings WHERE term = ?', (term,)))
+        return dict(self._select(
+            'SELECT doc, tf FROM postings WHERE term = ? AND {}', [term],
+            'doc', docs))
+
+    def _positions(self, docs, frequencies):
+        """Returns {doc: {word: set of positions}} for words in docs.
+
+        frequencies: Dictionary of word to number of notes containing it
+        """
+        found = dict((doc, {}) for doc in docs)
+        for word in frequencies:
+            rows = self._select(
+                'SELECT doc, positions FROM postings WHERE term = ? AND {}',
+                [word], 'doc', docs, scan=len(docs) >= frequencies[word])
+            for doc, positions in rows:
+                found[doc][word] = set(map(int, positions.split(',')))
+        return found
+
+    def _frequency(self, term):
+        """Number of notes containing term."""
+        return self.db.execute(
+            'SELECT COUNT(*) FROM postings WHERE term = ?', (term,)).fetchone()[0]
+
+    def _candidates(self, frequencies, tags):
+        """Find docs with every term and tag.
+
+        @return tuple of ({term: {doc: tf}}, set of docs)
+        """
+        postings = {}
+        docs = None
+        for tag in tags:
+            tagged = set(row[0] for row in self.db.execute(
+                'SELECT doc FROM tags WHERE tag = ?', (tag,)))
+            docs = tagged if docs is None else docs & tagged
+        # rarest first so the set of docs shrinks as quickly as possible and
+        # the posting lists of common words are only read for those docs
+        for term in sorted(frequencies, key=frequencies.get):
+            if docs is not None and len(docs) < frequencies[term]:
+                found = self._postings(term, list(docs))
+            else:
+                found = self._postings(term)
+            docs = set(found) if docs is None else docs.intersection(found)
+            postings[term] = found
+        return (postings, docs or set())
+
+    def search(self, query, limit=20):
+        """Find notes matching query, best first.
+
+        @return list of (score, key, title)
+        """
+        terms, phrases, tags = parse_query(query)
+        for phrase in phrases:
+            terms.extend(phrase)
+        if not terms and not tags:
+            return []
+        frequencies = dict((term, self._frequency(term)) for term in terms)
+        postings, docs = self._candidates(frequencies, tags)
+        if phrases and docs:
+            positions = self._positions(docs, dict(
+                (word, frequencies[word]) for phrase in phrases
+                for word in phrase))
+            docs = set(
+                doc for doc in docs
+                if all(_is_phrase(positions[doc], p) for p in phrases))
+        count, total = self.db.execute(
+            'SELECT COUNT(*), TOTAL(length) FROM docs').fetchone()
+        average = total / count if count else 0
+        results = []
+        idfs = dict(
+            (term, math.log(1 + (count - frequency + 0.5) / (frequency + 0.5)))
+            for term, frequency in frequencies.iteritems())
+        rows = self._select(
+            'SELECT id, key, length, title FROM docs WHERE {}', [], 'id', docs,
+            scan=len(docs) * 4 > count)
+        for doc, key, length, title in rows:
+            # every note empty, as can be with a search by tag alone
+            norm = self.k1
+            if average:
+                norm *= 1 - self.b + self.b * length / average
+            score = 0.0
+            for term, found in postings.iteritems():
+                tf = found[doc]
+                score += idfs[term] * tf * (self.k1 + 1) / (tf + norm)
+            results.append((score, key, title))
+        return heapq.nsmallest(
+            limit, results, key=lambda result: (-result[0], result[1]))